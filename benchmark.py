@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+قياس أداء واجهة برمجة التطبيقات داخل العملية على قاعدة بيانات مؤقتة
+
+يشغّل التطبيق عبر ASGI دون خادم، ويقيس زمن الاستجابة (p50/p95/p99) وعدد الطلبات
+في الثانية لتسجيل الدخول ومسارات القوائم ورفع الفيديو عند مستويات تزامن محددة،
+ثم يكتب النتائج بصيغة JSON ويقارنها بنتائج أساسية سابقة إن وُجدت.
+
+مثال:
+    python benchmark.py --concurrency 1,10,50 --output bench.json
+    python benchmark.py --baseline bench.json --output bench_new.json --fail-on-regression
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# عدد الطلبات الافتراضي لكل سيناريو عند كل مستوى تزامن (تسجيل الدخول مكلف بسبب bcrypt)
+SCENARIO_REQUESTS = {
+    "login": 40,
+    "list_accounts": 300,
+    "list_schedules": 300,
+    "list_engagements": 300,
+    "upload": 100,
+}
+SEED_ACCOUNTS = 20
+SEED_SCHEDULES = 500
+SEED_ENGAGEMENTS = 500
+BENCH_USER = {"username": "bench_user", "email": "bench@example.com", "password": "BenchPassword123"}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+def prepare_environment(work_dir, storage_mode):
+    # يجب ضبط البيئة قبل استيراد main لأن إعداداته تُقرأ وقت الاستيراد
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["JWT_SECRET_KEY"] = secrets.token_hex(32)
+    os.environ["STORAGE_MODE"] = storage_mode
+    os.environ["SCHEDULE_DISPATCHER_ENABLED"] = "false"
+    os.environ.setdefault("PASSWORD_HASH_MAX_PENDING", "1024")
+    # سيناريو الدخول يرسل طلبات متزامنة لنفس المستخدم، وكل محاولة تُحجز قبل التحقق من كلمة المرور
+    os.environ.setdefault("LOGIN_MAX_FAILED_ATTEMPTS", "1000000")
+    os.chdir(work_dir)  # مجلد uploads نسبي لمجلد العمل
+    sys.path.insert(0, BASE_DIR)
+
+def seed_database(main, user_id):
+    # بيانات القوائم تُدرج مباشرة لأن قياس إنشائها ليس هدف هذه السيناريوهات
+    with main.SessionLocal() as session:
+        accounts = [
+            main.TikTokAccount(username=f"bench_account_{i}", password="x", country="السعودية", owner_id=user_id)
+            for i in range(SEED_ACCOUNTS)
+        ]
+        session.add_all(accounts)
+        session.flush()
+        start = datetime.now() + timedelta(days=1)
+        session.add_all(
+            main.Schedule(
+                video_path="uploads/bench.mp4", caption=f"caption {i}", schedule_time=start + timedelta(minutes=i),
+                status="pending", owner_id=user_id, account_id=accounts[i % SEED_ACCOUNTS].id
+            )
+            for i in range(SEED_SCHEDULES)
+        )
+        session.add_all(
+            main.Engagement(
+                account_id=accounts[i % SEED_ACCOUNTS].id, owner_id=user_id, engagement_type="like",
+                target_url=f"https://www.tiktok.com/@bench/video/{i}", status="completed"
+            )
+            for i in range(SEED_ENGAGEMENTS)
+        )
+        session.commit()
+        return accounts[0].id
+
+def build_scenarios(headers, account_id, upload_size):
+    schedule_time = (datetime.now() + timedelta(days=30)).isoformat()
+
+    def login(client, i):
+        return client.post("/token", data={"username": BENCH_USER["username"], "password": BENCH_USER["password"]})
+
+    def list_accounts(client, i):
+        return client.get("/tiktok-accounts/?limit=50", headers=headers)
+
+    def list_schedules(client, i):
+        return client.get("/schedules/?limit=50", headers=headers)
+
+    def list_engagements(client, i):
+        return client.get("/engagements/?limit=50", headers=headers)
+
+    def upload(client, i):
+        # محتوى فريد لكل طلب حتى لا يختصر التخزين المعنون بالمحتوى عملية الكتابة
+        video = secrets.token_bytes(16) + b"\0" * (upload_size - 16)
+        return client.post(
+            "/schedules/",
+            data={"caption": f"bench {i}", "schedule_time": schedule_time, "account_id": str(account_id)},
+            files={"video": (f"bench_{i}.mp4", video, "video/mp4")},
+            headers=headers,
+        )
+
+    return {
+        "login": login,
+        "list_accounts": list_accounts,
+        "list_schedules": list_schedules,
+        "list_engagements": list_engagements,
+        "upload": upload,
+    }
+
+async def run_level(client, make_request, total, concurrency, warmup):
+    for i in range(warmup):
+        await make_request(client, -1 - i)
+
+    latencies = []
+    errors = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await make_request(client, index)
+                code = response.status_code
+            except Exception as exc:
+                code = type(exc).__name__
+            latencies.append(time.perf_counter() - started)
+            if not (isinstance(code, int) and code < 400):
+                errors[str(code)] = errors.get(str(code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": sum(errors.values()),
+        "error_codes": errors,
+        "seconds": round(elapsed, 4),
+        "rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+async def run_benchmark(args):
+    import httpx
+    import main
+
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost", timeout=120) as client:
+            response = await client.post("/users/", json=BENCH_USER)
+            response.raise_for_status()
+            account_id = seed_database(main, response.json()["id"])
+            token = (await client.post(
+                "/token", data={"username": BENCH_USER["username"], "password": BENCH_USER["password"]}
+            )).json()["access_token"]
+            scenarios = build_scenarios({"Authorization": f"Bearer {token}"}, account_id, args.upload_size_kb * 1024)
+
+            for name in args.scenarios:
+                results[name] = {}
+                for concurrency in args.concurrency:
+                    total = args.requests or SCENARIO_REQUESTS[name]
+                    level = await run_level(client, scenarios[name], total, concurrency, min(args.warmup, total))
+                    results[name][str(concurrency)] = level
+                    print(
+                        f"{name:<17} c={concurrency:<4} rps={level['rps']:>9.1f} "
+                        f"p50={level['p50_ms']:>9.2f}ms p95={level['p95_ms']:>9.2f}ms "
+                        f"p99={level['p99_ms']:>9.2f}ms errors={level['errors']}"
+                    )
+    return results
+
+def compare_with_baseline(results, baseline, threshold):
+    # تراجع = زيادة p95 أو انخفاض rps بأكثر من النسبة المسموحة
+    regressions = []
+    print("\nالمقارنة مع النتائج الأساسية:")
+    for name, levels in results.items():
+        for concurrency, level in levels.items():
+            old = baseline.get("results", {}).get(name, {}).get(concurrency)
+            if old is None:
+                continue
+            p95_change = (level["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+            rps_change = (level["rps"] - old["rps"]) / old["rps"] if old["rps"] else 0.0
+            regressed = p95_change > threshold or rps_change < -threshold
+            marker = "✗" if regressed else "✓"
+            print(f"{marker} {name:<17} c={concurrency:<4} p95 {p95_change:+.1%}  rps {rps_change:+.1%}")
+            if regressed:
+                regressions.append({"scenario": name, "concurrency": concurrency,
+                                    "p95_change": round(p95_change, 4), "rps_change": round(rps_change, 4)})
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="قياس أداء واجهة برمجة التطبيقات داخل العملية")
+    parser.add_argument("--concurrency", default="1,10,50",
+                        type=lambda value: [int(level) for level in value.split(",")],
+                        help="مستويات التزامن مفصولة بفواصل")
+    parser.add_argument("--scenarios", default=",".join(SCENARIO_REQUESTS),
+                        type=lambda value: value.split(","),
+                        help=f"السيناريوهات: {', '.join(SCENARIO_REQUESTS)}")
+    parser.add_argument("--requests", type=int, default=None,
+                        help="عدد الطلبات لكل سيناريو ومستوى (يتجاوز القيم الافتراضية)")
+    parser.add_argument("--warmup", type=int, default=5, help="طلبات إحماء غير محسوبة قبل كل مستوى")
+    parser.add_argument("--upload-size-kb", type=int, default=256, help="حجم الفيديو المرفوع في سيناريو الرفع")
+    parser.add_argument("--storage-mode", default="production", choices=["default", "production"])
+    parser.add_argument("--output", default="benchmark_results.json", help="ملف نتائج JSON")
+    parser.add_argument("--baseline", help="ملف نتائج سابق للمقارنة")
+    parser.add_argument("--threshold", type=float, default=0.10, help="نسبة التراجع المسموحة (0.10 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="إنهاء برمز 1 عند وجود تراجع")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIO_REQUESTS]
+    if unknown:
+        parser.error(f"سيناريوهات غير معروفة: {', '.join(unknown)}")
+    return args
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    work_dir = tempfile.mkdtemp(prefix="tiktok_bench_")
+    try:
+        prepare_environment(work_dir, args.storage_mode)
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        os.chdir(BASE_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "storage_mode": args.storage_mode,
+            "concurrency": args.concurrency,
+            "upload_size_kb": args.upload_size_kb,
+        },
+        "results": results,
+    }
+
+    regressions = []
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.threshold)
+        report["baseline"] = {"path": baseline_path, "threshold": args.threshold, "regressions": regressions}
+
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, ensure_ascii=False, indent=2)
+    print(f"\nتم حفظ النتائج في {output}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,7 @@ sudo apt-get install -y nginx python3-pip nodejs npm
 echo "تثبيت متطلبات Python..."
 cd $BACKEND_DIR
 pip3 install -r requirements.txt
+pip3 install gunicorn
 
 echo "بناء تطبيق الواجهة الأمامية..."
 cd $FRONTEND_DIR
@@ -52,6 +53,9 @@ cat > $BACKEND_DIR/.env << EOL
 JWT_SECRET_KEY=$(openssl rand -hex 32)
 ALLOWED_ORIGINS=https://tiktok-automation.example.com,http://localhost:3000
 ENVIRONMENT=production
+STORAGE_MODE=production
+VIDEO_ACCEL_REDIRECT_PREFIX=/protected-uploads/
+METRICS_TOKEN=$(openssl rand -hex 16)
 EOL
 
 echo "إعادة تشغيل الخدمات..."
@@ -0,0 +1,25 @@
+# إعدادات Gunicorn لتشغيل التطبيق على عدة عمليات تستخدم كل أنوية الخادم
+# التشغيل: gunicorn -c gunicorn.conf.py main:app
+import multiprocessing
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# يقرؤه main.py لتقسيم مجمع اتصالات قاعدة البيانات وخيوط التشفير على العمليات
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# تحميل التطبيق مرة واحدة في العملية الرئيسية ثم نسخه للعمال
+preload_app = True
+
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+def when_ready(server):
+    # تجهيز مخطط قاعدة البيانات مرة واحدة قبل تشغيل العمال بدلاً من تنافسهم عليه
+    import main
+    main.ensure_schema_once()
+    main.engine.dispose()
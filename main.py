@@ -1,48 +1,190 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Request
+import time
+_IMPORT_STARTED = time.perf_counter()  # لقياس زمن استيراد الوحدة
+
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from sqlalchemy import create_engine, event, inspect, select, insert, update, delete, func, tuple_, or_, case, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from pydantic import BaseModel, EmailStr, validator, constr
-from typing import List, Optional
+from sqlalchemy.orm import sessionmaker, Session, relationship, object_session, aliased
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from pydantic import BaseModel, EmailStr, ValidationError, validator, constr
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 import os
 import json
-import shutil
 from jose import JWTError, jwt
 import sys
 from passlib.context import CryptContext
 import secrets
 import re
+import asyncio
+import bisect
+import contextvars
+import heapq
+import socket
+import threading
+import tracemalloc
+import importlib
+import hashlib
+import base64
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
-
-# إضافة مسار نظام أتمتة تيك توك للوصول إلى الوحدات الموجودة
-sys.path.append('/home/ubuntu/tiktok_automation')
-
-# استيراد وحدات نظام أتمتة تيك توك
-try:
-    from src.proxy.proxy_manager import ProxyManager
-    from src.account.account_manager import AccountManager
-    from src.scheduler.schedule_manager import ScheduleManager
-    from src.mobile.mobile_simulator import MobileSimulator
-    from src.engagement.tiktok_engagement import TikTokEngagement
-    TIKTOK_AUTOMATION_AVAILABLE = True
-except ImportError:
-    print("تحذير: لم يتم العثور على وحدات نظام أتمتة تيك توك")
-    TIKTOK_AUTOMATION_AVAILABLE = False
+from starlette.requests import ClientDisconnect
+from starlette.routing import Match
+from contextlib import asynccontextmanager
+import anyio
+
+# أزمنة الاستيراد وبدء التشغيل بالثواني
+startup_timings = {}
+
+# مسار نظام أتمتة تيك توك للوصول إلى الوحدات الموجودة
+TIKTOK_AUTOMATION_PATH = os.environ.get("TIKTOK_AUTOMATION_PATH", "/home/ubuntu/tiktok_automation")
+_automation_modules = None
+_automation_lock = threading.Lock()
+
+def load_automation() -> dict:
+    # استيراد وحدات نظام أتمتة تيك توك عند أول استخدام بدلاً من وقت استيراد التطبيق
+    global _automation_modules
+    if _automation_modules is not None:
+        return _automation_modules
+    with _automation_lock:
+        if _automation_modules is None:
+            started = time.perf_counter()
+            if TIKTOK_AUTOMATION_PATH not in sys.path:
+                sys.path.append(TIKTOK_AUTOMATION_PATH)
+            try:
+                from src.proxy.proxy_manager import ProxyManager
+                from src.account.account_manager import AccountManager
+                from src.scheduler.schedule_manager import ScheduleManager
+                from src.mobile.mobile_simulator import MobileSimulator
+                from src.engagement.tiktok_engagement import TikTokEngagement
+                modules = {
+                    "ProxyManager": ProxyManager,
+                    "AccountManager": AccountManager,
+                    "ScheduleManager": ScheduleManager,
+                    "MobileSimulator": MobileSimulator,
+                    "TikTokEngagement": TikTokEngagement,
+                }
+            except ImportError:
+                print("تحذير: لم يتم العثور على وحدات نظام أتمتة تيك توك")
+                modules = {}
+            startup_timings["automation_import"] = time.perf_counter() - started
+            _automation_modules = modules
+    return _automation_modules
 
 # إعداد قاعدة البيانات
-SQLALCHEMY_DATABASE_URL = "sqlite:///./tiktok_web.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./tiktok_web.db")
+# المسار غير المتزامن يستخدم مشغل aiosqlite على نفس ملف قاعدة البيانات
+ASYNC_DATABASE_URL = os.environ.get(
+    "ASYNC_DATABASE_URL",
+    SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
+# عدد عمليات الخادم (يضبطه gunicorn.conf.py)؛ الحدود الافتراضية للمجمع إجمالية وتُقسم على العمليات
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# إعدادات مجمع الاتصالات والمهلات (قابلة للتعديل من متغيرات البيئة)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", str(max(2, 5 // WEB_CONCURRENCY))))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", str(max(2, 10 // WEB_CONCURRENCY))))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))  # مهلة انتظار اتصال من المجمع بالثواني
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))  # إعادة تدوير الاتصالات القديمة بالثواني
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "15"))  # مهلة انتظار قفل SQLite بالثواني
+
+def _engine_options(poolclass):
+    options = {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+        options["connect_args"] = {"timeout": DB_BUSY_TIMEOUT, "check_same_thread": False}
+    return options
+
+# المحرك المتزامن يبقى لإنشاء الجداول والسكريبتات، أما المسارات فتستخدم المحرك غير المتزامن
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **_engine_options(QueuePool))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(AsyncAdaptedQueuePool))
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+# مجمع مستقل لكاتب الدفعات: الطلبات التي تحجز اتصالات القراءة وهي تنتظر الكاتب لا تستنفد اتصالاته
+write_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(AsyncAdaptedQueuePool))
+WriteSessionLocal = sessionmaker(
+    bind=write_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+# وضع التخزين للإنتاج: تفعيل WAL وضبط إعدادات SQLite وتمرير عمليات الكتابة عبر كاتب واحد
+STORAGE_MODE = os.environ.get("STORAGE_MODE", "default")  # default, production
+SQLITE_PRODUCTION_MODE = STORAGE_MODE == "production" and SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+WRITE_BATCH_MAX = int(os.environ.get("WRITE_BATCH_MAX", "64"))
+WRITE_BATCH_DELAY_MS = float(os.environ.get("WRITE_BATCH_DELAY_MS", "0"))
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")  # القراءة لا تنتظر الكتابة
+    cursor.execute("PRAGMA synchronous=NORMAL")  # آمن مع WAL ويقلل عمليات fsync
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")  # القيمة السالبة بالكيلوبايت
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+if SQLITE_PRODUCTION_MODE:
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    event.listen(write_engine.sync_engine, "connect", _apply_sqlite_pragmas)
 Base = declarative_base()
 
 # إعداد مصادقة JWT
-# تحسين الأمان: استخدام مفتاح سري معقد وعشوائي من متغيرات البيئة أو توليده عشوائياً
-SECRET_KEY = os.environ.get("JWT_SECRET_KEY", secrets.token_hex(32))
+# تحسين الأمان: استخدام مفتاح سري معقد وعشوائي من متغيرات البيئة، وإلا من ملف مشترك
+# يُولَّد مرة واحدة حتى تقبل كل عمليات الخادم التوكنات الموقعة من أي منها وبعد إعادة التشغيل
+JWT_SECRET_KEY_FILE = os.environ.get("JWT_SECRET_KEY_FILE", "jwt_secret.key")
+
+def _read_secret_key_file() -> str:
+    try:
+        with open(JWT_SECRET_KEY_FILE) as key_file:
+            return key_file.read().strip()
+    except FileNotFoundError:
+        return ""
+
+def load_secret_key() -> str:
+    key = os.environ.get("JWT_SECRET_KEY") or _read_secret_key_file()
+    if key:
+        return key
+    # الكتابة في ملف مؤقت بصلاحيات 0600 ثم ربطه بالاسم النهائي؛ os.link يفشل إذا سبقتنا عملية أخرى
+    directory, name = os.path.split(os.path.abspath(JWT_SECRET_KEY_FILE))
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{secrets.token_hex(4)}")
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, "w") as key_file:
+            key_file.write(secrets.token_hex(32))
+            key_file.flush()
+            os.fsync(key_file.fileno())
+        try:
+            os.link(temp_path, JWT_SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(temp_path)
+    key = _read_secret_key_file()
+    if not key:
+        raise RuntimeError(f"ملف مفتاح JWT فارغ: {JWT_SECRET_KEY_FILE}")
+    return key
+
+SECRET_KEY = load_secret_key()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # تقليل مدة صلاحية التوكن لتحسين الأمان
 
@@ -73,7 +215,7 @@ class TikTokAccount(Base):
     password = Column(String)
     country = Column(String)
     proxy = Column(String, nullable=True)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     
     owner = relationship("User", back_populates="accounts")
     schedules = relationship("Schedule", back_populates="account", cascade="all, delete-orphan")
@@ -83,15 +225,26 @@ class Schedule(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     video_path = Column(String)
+    video_size = Column(Integer, nullable=True)
+    video_sha256 = Column(String, nullable=True)
     caption = Column(String)
     schedule_time = Column(DateTime)
     tags = Column(String, nullable=True)
-    status = Column(String, default="pending")  # pending, completed, failed
+    status = Column(String, default="pending")  # pending, processing, completed, failed
+    claimed_at = Column(DateTime, nullable=True)
+    claimed_by = Column(String, nullable=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
     account_id = Column(Integer, ForeignKey("tiktok_accounts.id"))
     
     owner = relationship("User", back_populates="schedules")
     account = relationship("TikTokAccount", back_populates="schedules")
+    
+    __table_args__ = (
+        Index("ix_schedules_owner_id_status", "owner_id", "status"),
+        Index("ix_schedules_status_schedule_time", "status", "schedule_time"),
+        # فهرس واحد لترقيم قائمة المستخدم بالمؤشر ولاستعلامات التقويم دون قراءة صفوف الجدول
+        Index("ix_schedules_owner_id_schedule_time_id", "owner_id", "schedule_time", "id", "status", "account_id"),
+    )
 
 class Proxy(Base):
     __tablename__ = "proxies"
@@ -101,11 +254,39 @@ class Proxy(Base):
     country = Column(String, index=True)
     is_active = Column(Boolean, default=True)
 
+class VideoBlob(Base):
+    __tablename__ = "video_blobs"
+    
+    # تخزين معنون بالمحتوى: كل فيديو فريد يُحفظ مرة واحدة ويُشار إليه من عدة جدولات
+    sha256 = Column(String, primary_key=True)
+    path = Column(String)
+    size = Column(Integer)
+    ref_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    
+    # جلسة رفع قابلة للاستئناف: يُكتب الملف على أجزاء ثم يُحوَّل إلى جدولة
+    id = Column(String, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    filename = Column(String)
+    total_size = Column(Integer)
+    received = Column(Integer, default=0)
+    temp_path = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+    # عقد كتابة يمنع طلبين من الكتابة في نفس الملف في الوقت نفسه
+    writer = Column(String, nullable=True)
+    writer_expires_at = Column(DateTime, nullable=True)
+
 class Engagement(Base):
     __tablename__ = "engagements"
     
     id = Column(Integer, primary_key=True, index=True)
     account_id = Column(Integer, ForeignKey("tiktok_accounts.id"))
+    # مالك الحساب منسوخ هنا حتى تُقرأ قائمة التفاعلات بمسح نطاق من الفهرس دون ضم الحسابات أو فرز
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     engagement_type = Column(String)  # like, comment, share, save, follow
     target_url = Column(String)
     target_username = Column(String, nullable=True)
@@ -115,9 +296,244 @@ class Engagement(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     account = relationship("TikTokAccount")
+    
+    __table_args__ = (
+        Index("ix_engagements_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        Index("ix_engagements_account_id_created_at", "account_id", "created_at"),  # لحذف تفاعلات الحساب معه
+    )
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    
+    # صندوق الصادر: تغييرات تُثبت مع بياناتها ثم تُرسل إلى نظام الأتمتة في الخلفية
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String)  # account.add, account.remove, schedule.add, schedule.remove
+    aggregate = Column(String)  # أحداث نفس المفتاح تُسلَّم بترتيب إنشائها
+    payload = Column(Text)
+    status = Column(String, default="pending")  # pending, processing, delivered, dead
+    attempts = Column(Integer, default=0)
+    available_at = Column(DateTime, default=datetime.utcnow)
+    claimed_by = Column(String, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_outbox_events_status_available_at", "status", "available_at"),
+        Index("ix_outbox_events_aggregate_id", "aggregate", "id"),
+    )
+
+class CollectionVersion(Base):
+    __tablename__ = "collection_versions"
+    
+    # عداد لكل مستخدم ومجموعة يُرفع مع كل كتابة عليها؛ منه تُشتق وسوم ETag للقوائم والتفاصيل
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    collection = Column(String, primary_key=True)  # accounts, schedules, engagements
+    version = Column(Integer, nullable=False, default=0)
+
+class UserCounter(Base):
+    __tablename__ = "user_counters"
+    
+    # عدادات لوحة التحكم تُحدَّث مع كل كتابة: accounts و schedules.<الحالة>
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+class ScheduleHourBucket(Base):
+    __tablename__ = "schedule_hour_buckets"
+    
+    # عدد الجدولات المعلقة لكل مستخدم في كل ساعة؛ منها تُحسب الجدولات القادمة دون مسح الجدولات
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    pending = Column(Integer, nullable=False, default=0)
+
+class LoginAttempt(Base):
+    __tablename__ = "login_attempts"
+    
+    # محاولات الدخول لكل مستخدم في نافذة ثابتة تبدأ من أول محاولة؛ مشتركة بين عمليات الخادم
+    key = Column(String, primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    window_started_at = Column(DateTime, nullable=False)
 
 # إنشاء جداول قاعدة البيانات
-Base.metadata.create_all(bind=engine)
+def ensure_columns(bind):
+    # إضافة الأعمدة الجديدة القابلة للقيم الفارغة إلى الجداول الموجودة مسبقاً
+    inspector = inspect(bind)
+    added = set()
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
+                    added.add((table.name, column.name))
+    return added
+
+def backfill_engagement_owners(bind):
+    # تعبئة مالك التفاعلات القديمة من حساباتها مرة واحدة عند إضافة العمود
+    account_owner = select(TikTokAccount.owner_id).where(TikTokAccount.id == Engagement.account_id)
+    with bind.begin() as connection:
+        connection.execute(
+            update(Engagement).where(Engagement.owner_id.is_(None)).values(owner_id=account_owner.scalar_subquery())
+        )
+
+# فهارس حلت محلها فهارس أوسع؛ تُحذف حتى لا تكلف كل كتابة دون فائدة
+OBSOLETE_INDEXES = ("ix_schedules_owner_id_schedule_time", "ix_schedules_calendar")
+
+def ensure_indexes(bind):
+    # create_all لا يضيف الفهارس الجديدة إلى جداول موجودة مسبقاً
+    with bind.begin() as connection:
+        for name in OBSOLETE_INDEXES:
+            connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+def schedule_hour(schedule_time: datetime) -> datetime:
+    return schedule_time.replace(minute=0, second=0, microsecond=0)
+
+def rebuild_stat_counters(bind):
+    # تعبئة العدادات من البيانات الحالية؛ تُنفذ مرة واحدة عند إنشاء جداولها
+    counters = Counter()
+    hours = Counter()
+    with bind.begin() as connection:
+        for owner_id, count in connection.execute(
+            select(TikTokAccount.owner_id, func.count()).group_by(TikTokAccount.owner_id)
+        ):
+            counters[(owner_id, "accounts")] += count
+        for owner_id, schedule_status, count in connection.execute(
+            select(Schedule.owner_id, Schedule.status, func.count()).group_by(Schedule.owner_id, Schedule.status)
+        ):
+            counters[(owner_id, f"schedules.{schedule_status}")] += count
+        for owner_id, schedule_time in connection.execute(
+            select(Schedule.owner_id, Schedule.schedule_time).where(Schedule.status == "pending")
+        ):
+            hours[(owner_id, schedule_hour(schedule_time))] += 1
+        connection.execute(delete(UserCounter))
+        connection.execute(delete(ScheduleHourBucket))
+        if counters:
+            connection.execute(insert(UserCounter), [
+                {"owner_id": owner_id, "name": name, "value": value} for (owner_id, name), value in counters.items()
+            ])
+        if hours:
+            connection.execute(insert(ScheduleHourBucket), [
+                {"owner_id": owner_id, "hour": hour, "pending": value} for (owner_id, hour), value in hours.items()
+            ])
+
+def ensure_schema(bind):
+    rebuild_stats = not inspect(bind).has_table(UserCounter.__tablename__)
+    Base.metadata.create_all(bind=bind)
+    added_columns = ensure_columns(bind)
+    if (Engagement.__tablename__, "owner_id") in added_columns:
+        backfill_engagement_owners(bind)
+    ensure_indexes(bind)
+    if rebuild_stats:
+        rebuild_stat_counters(bind)
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def ensure_schema_once():
+    # يُستدعى من دورة حياة التطبيق؛ تكرار إنشاء التطبيق في الاختبارات لا يعيد فحص المخطط
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            started = time.perf_counter()
+            ensure_schema(engine)
+            startup_timings["schema"] = time.perf_counter() - started
+            _schema_ready = True
+
+# ذاكرة مؤقتة داخل العملية
+class TTLCache:
+    """ذاكرة مؤقتة محدودة الحجم تُخرج الأقدم استخداماً (LRU) ولكل عنصر مدة صلاحية."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # المفتاح -> (وقت الانتهاء، القيمة)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# المستخدمون الذين تم التحقق منهم في get_current_user، مفهرسون باسم المستخدم
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# إبطال المستخدم من الذاكرة المؤقتة عند تعديل صفه أو حذفه، بعد تثبيت المعاملة
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _mark_user_changed(mapper, connection, target):
+    user_cache.invalidate(target.username)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_usernames", set()).add(target.username)
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_bulk_user_change(orm_execute_state):
+    # التعديل الجماعي لا يمر بأحداث الكائن، لذلك يُفرغ كامل الذاكرة المؤقتة عند التثبيت
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ is User and not orm_execute_state.execution_options.get("preserves_user_cache"):
+        orm_execute_state.session.info["user_cache_stale"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    for username in session.info.pop("changed_usernames", ()):
+        user_cache.invalidate(username)
+    if session.info.pop("user_cache_stale", False):
+        user_cache.clear()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_user_changes(session):
+    session.info.pop("changed_usernames", None)
+    session.info.pop("user_cache_stale", None)
 
 # نماذج Pydantic مع التحقق من صحة البيانات
 class UserBase(BaseModel):
@@ -195,14 +611,51 @@ class ScheduleBase(BaseModel):
 class ScheduleCreate(ScheduleBase):
     account_id: int
 
-class ScheduleResponse(ScheduleBase):
+class ScheduleResponse(BaseModel):
+    # لا يرث شرط الوقت المستقبلي: الجدولات المنفذة تقع في الماضي
     id: int
+    caption: str
+    schedule_time: datetime
+    tags: Optional[str] = None
     video_path: str
+    video_size: Optional[int] = None
+    video_sha256: Optional[str] = None
     status: str
     
     class Config:
         orm_mode = True
 
+class ScheduleBatchItem(BaseModel):
+    caption: str
+    schedule_time: str
+    tags: Optional[str] = None
+
+class ScheduleBatchResult(BaseModel):
+    index: int
+    status: str  # created, failed, skipped
+    schedule: Optional[ScheduleResponse] = None
+    error: Optional[str] = None
+
+class UploadSessionCreate(BaseModel):
+    filename: constr(min_length=1, max_length=255)
+    size: int
+
+    @validator('size')
+    def validate_size(cls, v):
+        if v <= 0:
+            raise ValueError('حجم الملف يجب أن يكون أكبر من صفر')
+        return v
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    filename: str
+    total_size: int
+    received: int
+    expires_at: datetime
+    
+    class Config:
+        orm_mode = True
+
 class ProxyBase(BaseModel):
     address: str
     country: str
@@ -277,13 +730,426 @@ class EngagementResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class CalendarBucket(BaseModel):
+    start: datetime
+    total: int
+    statuses: Dict[str, int]
+
+class StatsResponse(BaseModel):
+    accounts: int
+    schedules: Dict[str, int]
+    schedules_total: int
+    upcoming_24h: int
+    upcoming_7d: int
+
+class ProfileRequest(BaseModel):
+    # بدون route: عينات من كل العملية طوال seconds؛ مع route: الطلبات requests التالية لهذا المسار
+    seconds: float = 10
+    route: Optional[str] = None
+    method: str = "GET"
+    requests: int = 10
+    interval_ms: float = 5
+
+    @validator('seconds')
+    def validate_seconds(cls, v):
+        if not 0 < v <= 600:
+            raise ValueError('مدة التحليل يجب أن تكون بين 0 و600 ثانية')
+        return v
+
+    @validator('requests')
+    def validate_requests(cls, v):
+        if not 1 <= v <= 1000:
+            raise ValueError('عدد الطلبات يجب أن يكون بين 1 و1000')
+        return v
+
+    @validator('interval_ms')
+    def validate_interval(cls, v):
+        if not 1 <= v <= 1000:
+            raise ValueError('فاصل أخذ العينات يجب أن يكون بين 1 و1000 مللي ثانية')
+        return v
+
+    @validator('method')
+    def validate_method(cls, v):
+        return v.upper()
+
 # وظائف المساعدة
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+class WriteQueue:
+    """كاتب واحد يجمع عمليات الكتابة الصغيرة ويثبتها في معاملة واحدة.
+
+    كل عملية دالة غير متزامنة تستقبل جلسة وتعيد نتيجتها، ويجب أن تنشئ كائناتها
+    داخلها حتى يمكن إعادة تنفيذها منفردة إذا فشلت الدفعة.
+    """
+
+    def __init__(self, session_factory, enabled, max_batch=64, max_delay=0.0):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    async def run(self, operation):
+        if not self.enabled:
+            return await self._execute_one(operation)
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        self._worker = None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # العامل لا يرث سياق الطلب الذي أنشأه، حتى لا تُنسب كتاباته إلى ذلك الطلب
+            self._worker = contextvars.Context().run(loop.create_task, self._drain())
+
+    async def _drain(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.max_delay:
+                await asyncio.sleep(self.max_delay)
+            # العمليات التي وصلت أثناء تثبيت الدفعة السابقة تنضم إلى هذه الدفعة
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._commit_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit_batch(self, batch):
+        pending = [(operation, future) for operation, future in batch if not future.cancelled()]
+        if not pending:
+            return
+        try:
+            async with self.session_factory() as session:
+                results = [await operation(session) for operation, _ in pending]
+                await session.commit()
+        except Exception as exc:
+            if len(pending) == 1:
+                _resolve_future(pending[0][1], exception=exc)
+                return
+            # فشل عنصر واحد لا يجب أن يسقط الدفعة كلها: إعادة تنفيذ كل عملية في معاملة مستقلة
+            for operation, future in pending:
+                try:
+                    result = await self._execute_one(operation)
+                except Exception as item_exc:
+                    _resolve_future(future, exception=item_exc)
+                else:
+                    _resolve_future(future, result=result)
+            return
+        self.batches += 1
+        self.writes += len(pending)
+        for (_, future), result in zip(pending, results):
+            _resolve_future(future, result=result)
+
+    async def _execute_one(self, operation):
+        async with self.session_factory() as session:
+            result = await operation(session)
+            await session.commit()
+        self.batches += 1
+        self.writes += 1
+        return result
+
+def _resolve_future(future, result=None, exception=None):
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+write_queue = WriteQueue(
+    WriteSessionLocal,
+    enabled=SQLITE_PRODUCTION_MODE,
+    max_batch=WRITE_BATCH_MAX,
+    max_delay=WRITE_BATCH_DELAY_MS / 1000,
+)
+
+async def add_and_flush(session: AsyncSession, obj):
+    session.add(obj)
+    await session.flush()
+    return obj
+
+# الترقيم بالمؤشر (keyset): المؤشر مفتاح ترتيب آخر صف مرمّز بـ base64 ويُعاد في رأس X-Next-Cursor
+def encode_cursor(values: list) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, order_columns: list) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(order_columns):
+            raise ValueError(cursor)
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else int(value)
+            for value, column in zip(values, order_columns)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="مؤشر الصفحة غير صالح")
+
+async def paginate(
+    db: AsyncSession,
+    query,
+    order_columns: list,
+    response: Response,
+    skip: int,
+    limit: int,
+    cursor: Optional[str] = None,
+    descending: bool = False,
+):
+    query = query.order_by(*[column.desc() if descending else column for column in order_columns])
+    if cursor:
+        key = tuple_(*order_columns)
+        values = tuple_(*decode_cursor(cursor, order_columns))
+        query = query.where(key < values if descending else key > values)
+    elif skip:
+        # الإزاحة تبقى مدعومة للتوافق، لكنها تبطؤ كلما تعمقت الصفحات
+        query = query.offset(skip)
+    # جلب صف إضافي لمعرفة وجود صفحة تالية دون استعلام عد
+    rows = (await db.execute(query.limit(limit + 1))).scalars().all()
+    if rows and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor([getattr(rows[-1], column.key) for column in order_columns])
+    return rows
+
+# الطلبات الشرطية للقوائم والتفاصيل: الوسم يُشتق من عداد المجموعة دون قراءة صفوفها
+if SQLALCHEMY_DATABASE_URL.startswith("postgresql"):
+    from sqlalchemy.dialects.postgresql import insert as upsert_insert
+else:
+    from sqlalchemy.dialects.sqlite import insert as upsert_insert
+
+ETAG_REPRESENTATION = "1"  # يُرفع عند تغيير شكل الاستجابات حتى لا تُعاد نسخ قديمة بـ 304
+
+async def bump_collection_versions(session: AsyncSession, owner_ids, *collections: str):
+    # يُستدعى داخل معاملة الكتابة نفسها حتى لا يتقدم العداد دون البيانات أو العكس
+    rows = [
+        {"owner_id": owner_id, "collection": collection, "version": 1}
+        for owner_id in set(owner_ids) for collection in collections
+    ]
+    if not rows:
+        return
+    statement = upsert_insert(CollectionVersion).values(rows)
+    await session.execute(statement.on_conflict_do_update(
+        index_elements=[CollectionVersion.owner_id, CollectionVersion.collection],
+        set_={"version": CollectionVersion.version + 1},
+    ))
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match يستخدم المقارنة الضعيفة حسب RFC 9110
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+async def check_collection_etag(db: AsyncSession, request: Request, response: Response, owner_id: int, collection: str):
+    # العداد يُقرأ قبل الصفوف، فالصفوف المعادة ليست أقدم من الوسم أبداً
+    version = await db.scalar(
+        select(CollectionVersion.version)
+        .where(CollectionVersion.owner_id == owner_id, CollectionVersion.collection == collection)
+    )
+    key = (ETAG_REPRESENTATION, collection, owner_id, version or 0, request.url.path, sorted(request.query_params.multi_items()))
+    etag = '"' + hashlib.sha256(repr(key).encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+class StatChanges:
+    """فروق عدادات لوحة التحكم داخل معاملة كتابة واحدة، تُطبق بعبارة upsert لكل جدول."""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.hours = Counter()
+
+    def account(self, owner_id: int, delta: int = 1):
+        self.counters[(owner_id, "accounts")] += delta
+
+    def schedule(self, owner_id: int, schedule_status: str, schedule_time: datetime, delta: int = 1):
+        self.counters[(owner_id, f"schedules.{schedule_status}")] += delta
+        if schedule_status == "pending":
+            self.hours[(owner_id, schedule_hour(schedule_time))] += delta
+
+    def move_schedule(self, owner_id: int, schedule_time: datetime, old_status: str, new_status: str):
+        self.schedule(owner_id, old_status, schedule_time, -1)
+        self.schedule(owner_id, new_status, schedule_time)
+
+    async def apply(self, session: AsyncSession):
+        counters = [
+            {"owner_id": owner_id, "name": name, "value": delta}
+            for (owner_id, name), delta in self.counters.items() if delta
+        ]
+        if counters:
+            statement = upsert_insert(UserCounter).values(counters)
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[UserCounter.owner_id, UserCounter.name],
+                set_={"value": UserCounter.value + statement.excluded.value},
+            ))
+        hours = [
+            {"owner_id": owner_id, "hour": hour, "pending": delta}
+            for (owner_id, hour), delta in self.hours.items() if delta
+        ]
+        if hours:
+            statement = upsert_insert(ScheduleHourBucket).values(hours)
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[ScheduleHourBucket.owner_id, ScheduleHourBucket.hour],
+                set_={"pending": ScheduleHourBucket.pending + statement.excluded.pending},
+            ))
+            # الساعات التي فرغت لا داعي لبقائها
+            emptied = [row["owner_id"] for row in hours if row["pending"] < 0]
+            if emptied:
+                await session.execute(delete(ScheduleHourBucket).where(
+                    ScheduleHourBucket.owner_id.in_(set(emptied)), ScheduleHourBucket.pending <= 0
+                ))
+
+# حفظ الملفات المرفوعة على دفعات دون حجز حلقة الأحداث
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE_MB", "500")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE_KB", "1024")) * 1024
+UPLOAD_ROOT = os.environ.get("UPLOAD_ROOT", "uploads")
+
+def upload_too_large_exception():
+    return HTTPException(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        detail=f"حجم الملف يتجاوز الحد المسموح ({MAX_UPLOAD_SIZE // (1024 * 1024)} ميغابايت)",
+    )
+
+def _write_chunk(buffer, digest, chunk):
+    # التجزئة والكتابة في خيط العامل معاً، وكلاهما يحرر GIL للكتل الكبيرة
+    digest.update(chunk)
+    buffer.write(chunk)
+
+def _finish_file(buffer):
+    buffer.flush()
+    os.fsync(buffer.fileno())
+    buffer.close()
+
+def _discard_file(buffer, path):
+    buffer.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+async def save_upload(upload: UploadFile, file_path: str):
+    """يكتب الملف إلى ملف مؤقت على دفعات ثم يعيد تسميته ذرياً، ويعيد الحجم وبصمة SHA-256."""
+    if getattr(upload, "size", None) and upload.size > MAX_UPLOAD_SIZE:
+        raise upload_too_large_exception()
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.{secrets.token_hex(4)}.part"
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await run_in_threadpool(open, temp_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_UPLOAD_SIZE:
+                raise upload_too_large_exception()
+            await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+        await run_in_threadpool(_finish_file, buffer)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        await run_in_threadpool(_discard_file, buffer, temp_path)
+        raise
+    return size, digest.hexdigest()
+
+# مخزن الفيديو المعنون بالمحتوى
+BLOB_ROOT = os.path.join(UPLOAD_ROOT, "blobs")
+STAGING_ROOT = os.path.join(UPLOAD_ROOT, "staging")
+
+def blob_path_for(sha256: str, filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(BLOB_ROOT, sha256[:2], f"{sha256}{extension}")
+
+def is_blob_path(path: str) -> bool:
+    return os.path.abspath(path).startswith(os.path.abspath(BLOB_ROOT) + os.sep)
+
+async def stage_upload(upload: UploadFile):
+    staging_path = os.path.join(STAGING_ROOT, secrets.token_hex(16))
+    size, sha256 = await save_upload(upload, staging_path)
+    return staging_path, size, sha256
+
+async def acquire_video_blob(session: AsyncSession, sha256: str, size: int, path: str) -> str:
+    # زيادة عداد المراجع إن كان المحتوى مخزناً مسبقاً، وإلا تسجيل كائن جديد
+    result = await session.execute(
+        update(VideoBlob).where(VideoBlob.sha256 == sha256).values(ref_count=VideoBlob.ref_count + 1)
+    )
+    if result.rowcount:
+        return (await session.execute(select(VideoBlob.path).where(VideoBlob.sha256 == sha256))).scalar_one()
+    session.add(VideoBlob(sha256=sha256, path=path, size=size, ref_count=1))
+    await session.flush()
+    return path
+
+async def release_videos(session: AsyncSession, videos) -> list:
+    """ينقص مراجع فيديوهات الجدولات المحذوفة ويعيد الملفات التي يجب حذفها بعد التثبيت."""
+    removals = []
+    references = Counter()
+    for sha256, path in videos:
+        if sha256 and path and is_blob_path(path):
+            references[sha256] += 1
+        elif path:
+            # ملفات ما قبل المخزن المعنون تخص جدولة واحدة فقط
+            removals.append((None, path))
+    for sha256, count in references.items():
+        await session.execute(
+            update(VideoBlob).where(VideoBlob.sha256 == sha256).values(ref_count=VideoBlob.ref_count - count)
+        )
+    if references:
+        orphans = (await session.execute(
+            select(VideoBlob.sha256, VideoBlob.path)
+            .where(VideoBlob.sha256.in_(list(references)), VideoBlob.ref_count <= 0)
+        )).all()
+        if orphans:
+            await session.execute(delete(VideoBlob).where(VideoBlob.sha256.in_([sha256 for sha256, _ in orphans])))
+        removals.extend((sha256, path) for sha256, path in orphans)
+    return removals
+
+def place_blob_file(staging_path: str, blob_path: str):
+    if os.path.exists(blob_path):
+        os.remove(staging_path)
+    else:
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(staging_path, blob_path)
+
+def discard_staged_file(staging_path: str):
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+
+async def remove_video_files(removals: list):
+    for sha256, path in removals:
+        if sha256 is None:
+            await run_in_threadpool(discard_staged_file, path)
+            continue
+        # نقل الملف جانباً ثم التأكد من أن رفعاً متزامناً لم يُعد تسجيل نفس المحتوى بعد الحذف
+        tombstone = f"{path}.{secrets.token_hex(4)}.deleted"
+        try:
+            os.replace(path, tombstone)
+        except FileNotFoundError:
+            continue
+        async with AsyncSessionLocal() as session:
+            blob = await session.get(VideoBlob, sha256)
+        if blob is not None and blob.path == path and not os.path.exists(path):
+            os.replace(tombstone, path)
+        else:
+            await run_in_threadpool(discard_staged_file, tombstone)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -294,33 +1160,348 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
-
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
+# تشغيل bcrypt في منفذ مخصص محدود الحجم حتى لا تتوقف حلقة الأحداث أثناء التشفير
+PASSWORD_HASH_WORKERS = int(os.environ.get(
+    "PASSWORD_HASH_WORKERS", str(max(1, min(4, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "64"))
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0  # العمليات المرسلة التي لم تنته بعد (قيد التنفيذ أو في الانتظار)
+        self.rejected = 0
+        self._executor = None
+
+    @property
+    def queue_depth(self):
+        return max(0, self.pending - self.workers)
+
+    async def verify(self, plain_password, hashed_password):
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password):
+        return await self._run(get_password_hash, password)
+
+    async def _run(self, func, *args):
+        # رفض الطلب بدلاً من تكديس طابور لا نهاية له عند موجة من تسجيلات الدخول
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="الخادم مشغول حالياً، يرجى المحاولة لاحقاً",
+                headers={"Retry-After": "1"},
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def reset_after_fork(self):
+        # خيوط المنفذ لا تنتقل إلى العملية الابن، فيُنشأ منفذ جديد عند أول استخدام
+        self._executor = None
+        self.pending = 0
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+def _reset_after_fork():
+    # عند التحميل المسبق (preload) يرث كل عامل المحركات من العملية الرئيسية:
+    # يُهمل مجمع الاتصالات الموروث دون إغلاق اتصالات الأب، ويفتح العامل اتصالاته الخاصة
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+    write_engine.sync_engine.dispose(close=False)
+    password_hasher.reset_after_fork()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+class AutomationIntegrations:
+    """مكونات نظام الأتمتة تُنشأ مرة واحدة لكل عملية ويُعاد استخدامها بين الطلبات.
+
+    يمكن استبدال أي مكون بنسخة وهمية في الاختبارات عبر override.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader  # يعيد قاموس المصانع، ويُستدعى عند أول استخدام
+        self._factories = None
+        self._overrides = {}
+        self._instances = {}
+        self._locks = {}  # قفل لكل مكون: المكونات الخارجية غير مضمونة الأمان بين الخيوط
+        self._create_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.construct_seconds = {}
+        self.calls = Counter()
+        self.errors = Counter()
+        self.call_seconds = Counter()
+
+    def _factory(self, name: str):
+        if name in self._overrides:
+            return self._overrides[name]
+        if self._factories is None:
+            with self._create_lock:
+                if self._factories is None:
+                    self._factories = dict(self._loader())
+        return self._factories.get(name)
+
+    def has(self, name: str) -> bool:
+        return self._factory(name) is not None
+
+    def warm(self):
+        # يُستدعى من دورة الحياة في خيط عامل حتى لا يدفع أول طلب كتابة ثمن الاستيراد
+        self._factory(None)
+
+    def override(self, name: str, factory):
+        # factory=None يعطّل المكون
+        with self._create_lock:
+            self._overrides[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        factory = self._factory(name)
+        with self._create_lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                started = time.perf_counter()
+                instance = factory()
+                self.construct_seconds[name] = time.perf_counter() - started
+                self._locks.setdefault(name, threading.Lock())
+                self._instances[name] = instance
+        return instance
+
+    def _invoke(self, name: str, method: str, args: tuple):
+        instance = self.get(name)
+        key = f"{name}.{method}"
+        started = time.perf_counter()
+        failed = False
+        try:
+            with self._locks[name]:
+                return getattr(instance, method)(*args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._stats_lock:
+                self.calls[key] += 1
+                self.call_seconds[key] += time.perf_counter() - started
+                if failed:
+                    self.errors[key] += 1
+
+    async def call(self, name: str, method: str, *args):
+        return await run_in_threadpool(self._invoke, name, method, args)
+
+    def stats(self):
+        with self._stats_lock:
+            calls = {
+                key: {
+                    "count": count,
+                    "errors": self.errors[key],
+                    "total_seconds": self.call_seconds[key],
+                    "avg_seconds": self.call_seconds[key] / count,
+                }
+                for key, count in self.calls.items()
+            }
+        return {"construct_seconds": dict(self.construct_seconds), "calls": calls}
+
+def _automation_factories():
+    modules = load_automation()
+    names = {"accounts": "AccountManager", "schedules": "ScheduleManager", "proxies": "ProxyManager"}
+    return {name: modules[class_name] for name, class_name in names.items() if class_name in modules}
+
+integrations = AutomationIntegrations(_automation_factories)
+
+async def get_user(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+async def get_owned_account(db: AsyncSession, account_id: int, owner_id: int):
+    result = await db.execute(
+        select(TikTokAccount).where(TikTokAccount.id == account_id, TikTokAccount.owner_id == owner_id)
+    )
+    return result.scalars().first()
+
+# كل محاولة دخول تُحجز قبل التحقق من كلمة المرور، فلا تتجاوز المحاولات المتزامنة الحد
+LOGIN_MAX_FAILED_ATTEMPTS = int(os.environ.get("LOGIN_MAX_FAILED_ATTEMPTS", "5"))
+LOGIN_LOCKOUT_WINDOW = float(os.environ.get("LOGIN_LOCKOUT_WINDOW_SECONDS", "1800"))
+# memory أو database أو module:factory؛ الافتراضي database عند تعدد العمليات حتى لا يتضاعف الحد بعددها
+LOGIN_ATTEMPT_STORE = os.environ.get("LOGIN_ATTEMPT_STORE") or ("database" if WEB_CONCURRENCY > 1 else "memory")
+LOGIN_ATTEMPT_STORE_SIZE = int(os.environ.get("LOGIN_ATTEMPT_STORE_SIZE", "100000"))
+LAST_LOGIN_FLUSH_INTERVAL = float(os.environ.get("LAST_LOGIN_FLUSH_INTERVAL", "30"))
+
+class InMemoryLoginAttemptStore:
+    """مخزن محاولات لكل مفتاح ضمن نافذة زمنية منزلقة، محلي للعملية.
+
+    أي مخزن مشترك (Redis مثلاً) يكفيه تنفيذ نفس الدالتين غير المتزامنتين reserve و reset.
+    """
+
+    def __init__(self, max_failures: int, window: float, maxsize: int = 100000):
+        self.max_failures = max_failures
+        self.window = window
+        self.maxsize = maxsize
+        self._attempts = OrderedDict()  # المفتاح -> deque بأوقات المحاولات
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return None
+        return attempts
+
+    async def reserve(self, key) -> bool:
+        # العد والحجز في خطوة واحدة؛ المحاولة تبقى محسوبة حتى يُعاد التعيين عند النجاح
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, now)
+            if attempts is None:
+                attempts = self._attempts[key] = deque(maxlen=self.max_failures)
+            elif len(attempts) >= self.max_failures:
+                return False
+            attempts.append(now)
+            self._attempts.move_to_end(key)
+            while len(self._attempts) > self.maxsize:
+                self._attempts.popitem(last=False)
+            return True
+
+    async def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+class DatabaseLoginAttemptStore:
+    """مخزن محاولات في جدول login_attempts يشترك فيه كل عمال الخادم ويبقى بعد إعادة التشغيل."""
+
+    def __init__(self, max_failures: int, window: float):
+        self.max_failures = max_failures
+        self.window = window
+
+    async def reserve(self, key) -> bool:
+        # upsert شرطي واحد يحجز المحاولة ذرياً؛ لا يعيد صفاً إن بلغت النافذة الحد
+        now = datetime.utcnow()
+        expired = LoginAttempt.window_started_at <= now - timedelta(seconds=self.window)
+        statement = upsert_insert(LoginAttempt).values(key=str(key), attempts=1, window_started_at=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[LoginAttempt.key],
+            set_={
+                "attempts": case((expired, 1), else_=LoginAttempt.attempts + 1),
+                "window_started_at": case((expired, now), else_=LoginAttempt.window_started_at),
+            },
+            where=or_(expired, LoginAttempt.attempts < self.max_failures),
+        ).returning(LoginAttempt.attempts)
+        
+        async def reserve_attempt(session):
+            return (await session.execute(statement)).first()
+        
+        return await write_queue.run(reserve_attempt) is not None
+
+    async def reset(self, key):
+        await write_queue.run(lambda session: session.execute(
+            delete(LoginAttempt).where(LoginAttempt.key == str(key))
+        ))
+
+def load_login_attempt_store():
+    if LOGIN_ATTEMPT_STORE == "memory":
+        return InMemoryLoginAttemptStore(LOGIN_MAX_FAILED_ATTEMPTS, LOGIN_LOCKOUT_WINDOW, LOGIN_ATTEMPT_STORE_SIZE)
+    if LOGIN_ATTEMPT_STORE == "database":
+        return DatabaseLoginAttemptStore(LOGIN_MAX_FAILED_ATTEMPTS, LOGIN_LOCKOUT_WINDOW)
+    module_name, _, attr = LOGIN_ATTEMPT_STORE.partition(":")
+    factory = getattr(importlib.import_module(module_name), attr)
+    return factory(LOGIN_MAX_FAILED_ATTEMPTS, LOGIN_LOCKOUT_WINDOW)
+
+login_attempts = load_login_attempt_store()
+
+class LastLoginRecorder:
+    """يجمع أوقات آخر دخول في الذاكرة ويكتبها إلى جدول المستخدمين على دفعات دورية."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.flushed = 0
+        self._pending = {}  # معرف المستخدم -> وقت آخر دخول
+        self._task = None
+        self._stopping = None
+
+    def record(self, user_id: int):
+        self._pending[user_id] = datetime.utcnow()
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as exc:
+                print(f"خطأ في حفظ أوقات آخر دخول: {exc}")
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        rows = [{"id": user_id, "last_login": last_login} for user_id, last_login in batch.items()]
+        try:
+            await write_queue.run(lambda session: session.execute(
+                update(User).execution_options(preserves_user_cache=True),  # وقت الدخول لا يؤثر على المستخدم المخزن
+                rows,
+            ))
+        except Exception:
+            # إعادة الدفعة دون الكتابة فوق أوقات أحدث سُجلت أثناء المحاولة
+            self._pending = {**batch, **self._pending}
+            raise
+        self.flushed += len(rows)
+        return len(rows)
+
+last_login_recorder = LastLoginRecorder(LAST_LOGIN_FLUSH_INTERVAL)
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user(db, username)
     if not user:
         return False
+    # إعادة الاتصال إلى المجمع قبل انتظار الكاتب و bcrypt، فلا تحجز محاولات الدخول المتزامنة كل الاتصالات
+    await db.close()
     
-    # التحقق من عدد محاولات تسجيل الدخول الفاشلة
-    if user.failed_login_attempts >= 5:
-        # إعادة تعيين عداد المحاولات بعد 30 دقيقة
-        if user.last_login and (datetime.utcnow() - user.last_login) > timedelta(minutes=30):
-            user.failed_login_attempts = 0
-        else:
-            return False
+    # حجز المحاولة قبل bcrypt؛ الرفض هنا يعني أن المحاولات بلغت الحد خلال نافذة القفل
+    if not await login_attempts.reserve(user.id):
+        return False
     
-    if not verify_password(password, user.hashed_password):
-        # زيادة عداد محاولات تسجيل الدخول الفاشلة
-        user.failed_login_attempts += 1
-        user.last_login = datetime.utcnow()
-        db.commit()
+    if not await password_hasher.verify(password, user.hashed_password):
         return False
     
-    # إعادة تعيين عداد المحاولات عند نجاح تسجيل الدخول
-    user.failed_login_attempts = 0
-    user.last_login = datetime.utcnow()
-    db.commit()
+    # إعادة تعيين العداد عند نجاح الدخول؛ وقت الدخول يُحفظ لاحقاً مع الدفعة التالية
+    await login_attempts.reset(user.id)
+    last_login_recorder.record(user.id)
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -333,29 +1514,49 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt, int(expire.timestamp())
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# التوكنات التي تم التحقق منها، مفهرسة ببصمة التوكن وتنتهي مع انتهاء صلاحيته
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "4096"))
+token_cache = TTLCache(TOKEN_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+def verify_access_token(token: str) -> Optional[TokenData]:
+    token_key = hashlib.sha256(token.encode()).digest()
+    token_data = token_cache.get(token_key)
+    if token_data is not None:
+        return token_data
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username: str = payload.get("sub")
+    exp: int = payload.get("exp")
+    if username is None or exp is None:
+        return None
+    
+    # التحقق من انتهاء صلاحية التوكن
+    if datetime.fromtimestamp(exp) < datetime.utcnow():
+        return None
+    
+    token_data = TokenData(username=username, exp=exp)
+    token_cache.set(token_key, token_data, ttl=exp - time.time())
+    return token_data
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="بيانات الاعتماد غير صالحة",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        exp: int = payload.get("exp")
-        if username is None or exp is None:
-            raise credentials_exception
-        
-        # التحقق من انتهاء صلاحية التوكن
-        if datetime.fromtimestamp(exp) < datetime.utcnow():
-            raise credentials_exception
-            
-        token_data = TokenData(username=username, exp=exp)
-    except JWTError:
+    token_data = verify_access_token(token)
+    if token_data is None:
         raise credentials_exception
-    user = get_user(db, username=token_data.username)
+    user = user_cache.get(token_data.username)
     if user is None:
-        raise credentials_exception
+        user = await get_user(db, username=token_data.username)
+        if user is None:
+            raise credentials_exception
+        # فصل الكائن عن الجلسة حتى يمكن مشاركته بين الطلبات للقراءة فقط
+        db.expunge(user)
+        user_cache.set(token_data.username, user)
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -363,53 +1564,456 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="المستخدم غير نشط")
     return current_user
 
-# إنشاء تطبيق FastAPI
-app = FastAPI(title="نظام أتمتة تيك توك", description="واجهة برمجة تطبيقات لنظام أتمتة تيك توك")
+# صندوق الصادر لمزامنة الحسابات والجدولات مع نظام الأتمتة
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE = float(os.environ.get("OUTBOX_RETRY_BASE", "2"))  # ثوانٍ، تتضاعف مع كل محاولة
+OUTBOX_RETRY_MAX = float(os.environ.get("OUTBOX_RETRY_MAX", "600"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "30"))  # لالتقاط أحداث العمليات الأخرى
+OUTBOX_CLAIM_LEASE = float(os.environ.get("OUTBOX_CLAIM_LEASE", "300"))
+
+# الموضوع -> (المكون، الدالة، حقول الحمولة بترتيب المعاملات)
+OUTBOX_TOPICS = {
+    "account.add": ("accounts", "add_account", ("username", "password", "country", "proxy")),
+    "account.remove": ("accounts", "remove_account", ("username",)),
+    "schedule.add": ("schedules", "add_post", ("username", "video_path", "caption", "schedule_time", "tags")),
+    "schedule.remove": ("schedules", "remove_post", ("schedule_id",)),
+}
+OUTBOX_SECRET_FIELDS = ("password",)  # تُحذف من الحمولة بعد التسليم
+
+def enqueue_sync(session, topic: str, aggregate: str, **payload):
+    # يُضاف إلى نفس جلسة التغيير حتى يُثبت معه أو يُلغى معه
+    if not integrations.has(OUTBOX_TOPICS[topic][0]):
+        return
+    if topic.startswith("schedule.") and dispatcher_publishes():
+        return
+    session.add(OutboxEvent(
+        topic=topic,
+        aggregate=aggregate,
+        payload=json.dumps(payload, ensure_ascii=False),
+        status="pending",
+        attempts=0,
+        available_at=datetime.utcnow()
+    ))
+
+def scrub_payload(payload: dict) -> str:
+    return json.dumps(
+        {key: value for key, value in payload.items() if key not in OUTBOX_SECRET_FIELDS},
+        ensure_ascii=False
+    )
 
-# إضافة وسيط للتحقق من المضيفين الموثوقين
-app.add_middleware(
-    TrustedHostMiddleware, allowed_hosts=["localhost", "127.0.0.1", "tiktok-automation.example.com"]
-)
+class OutboxRelay:
+    """يسلّم أحداث صندوق الصادر إلى نظام الأتمتة على دفعات مع إعادة المحاولة والتراجع الأسي.
+
+    يُحجز كل حدث بتحديث شرطي قبل تسليمه، ولا يُسلَّم حدث قبل الأحداث الأقدم لنفس المفتاح.
+    """
+
+    def __init__(self, session_factory, batch_size=50, max_attempts=8, retry_base=2.0,
+                 retry_max=600.0, poll_interval=30.0, claim_lease=300.0):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.claim_lease = claim_lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # الدفعة الجارية تُكمل وتسجل نتائجها قبل الخروج
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                if await self.drain_once() == self.batch_size:
+                    continue
+                timeout = await self._seconds_until_next()
+            except Exception as exc:
+                print(f"خطأ في مزامنة صندوق الصادر: {exc}")
+                timeout = 5
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        events = await write_queue.run(self._claim)
+        if not events:
+            return 0
+        outcomes = [(event.id, await self._deliver(event)) for event in events]
+        
+        async def record(session):
+            for event_id, values in outcomes:
+                await session.execute(
+                    update(OutboxEvent)
+                    .where(OutboxEvent.id == event_id, OutboxEvent.claimed_by == self.worker_id)
+                    .values(**values)
+                )
+        
+        await write_queue.run(record)
+        return len(events)
+
+    async def _claim(self, session):
+        now = datetime.utcnow()
+        # حجز انتهت مدته يعني أن العامل توقف أثناء التسليم؛ يُعاد الحدث للانتظار
+        await session.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.status == "processing", OutboxEvent.claimed_at < now - timedelta(seconds=self.claim_lease))
+            .values(status="pending")
+        )
+        earlier = aliased(OutboxEvent)
+        blocked = select(earlier.id).where(
+            earlier.aggregate == OutboxEvent.aggregate,
+            earlier.id < OutboxEvent.id,
+            earlier.status.in_(("pending", "processing"))
+        ).exists()
+        ids = (await session.execute(
+            select(OutboxEvent.id)
+            .where(OutboxEvent.status == "pending", OutboxEvent.available_at <= now, ~blocked)
+            .order_by(OutboxEvent.id)
+            .limit(self.batch_size)
+        )).scalars().all()
+        if not ids:
+            return []
+        await session.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_(ids), OutboxEvent.status == "pending")
+            .values(status="processing", claimed_by=self.worker_id, claimed_at=now)
+        )
+        result = await session.execute(
+            select(OutboxEvent)
+            .where(OutboxEvent.id.in_(ids), OutboxEvent.status == "processing",
+                   OutboxEvent.claimed_by == self.worker_id, OutboxEvent.claimed_at == now)
+            .order_by(OutboxEvent.id)
+        )
+        return result.scalars().all()
 
-# إعداد CORS - تحسين الأمان
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000", 
-        "https://tiktok-automation.example.com"
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE"],
-    allow_headers=["Authorization", "Content-Type"],
-    max_age=600,  # تحديد مدة صلاحية طلبات preflight
+    async def _deliver(self, event: OutboxEvent) -> dict:
+        payload = json.loads(event.payload)
+        attempts = event.attempts + 1
+        try:
+            integration, method, fields = OUTBOX_TOPICS[event.topic]
+            if not integrations.has(integration):
+                raise RuntimeError("نظام أتمتة تيك توك غير متاح")
+            await integrations.call(integration, method, *(payload.get(field) for field in fields))
+        except Exception as exc:
+            if attempts >= self.max_attempts:
+                self.dead += 1
+                return {"status": "dead", "attempts": attempts, "last_error": str(exc)[:500],
+                        "payload": scrub_payload(payload)}
+            self.retried += 1
+            delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+            delay *= 0.5 + secrets.randbelow(1000) / 1000  # تشتيت حتى لا تتزامن المحاولات
+            return {"status": "pending", "attempts": attempts, "last_error": str(exc)[:500],
+                    "available_at": datetime.utcnow() + timedelta(seconds=delay)}
+        self.delivered += 1
+        return {"status": "delivered", "attempts": attempts, "last_error": None,
+                "delivered_at": datetime.utcnow(), "payload": scrub_payload(payload)}
+
+    async def _seconds_until_next(self) -> float:
+        async with self.session_factory() as session:
+            next_at = (await session.execute(
+                select(func.min(OutboxEvent.available_at)).where(OutboxEvent.status == "pending")
+            )).scalar()
+        if next_at is None:
+            return self.poll_interval
+        return min(self.poll_interval, max((next_at - datetime.utcnow()).total_seconds(), 0))
+
+outbox_relay = OutboxRelay(
+    AsyncSessionLocal,
+    batch_size=OUTBOX_BATCH_SIZE,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    retry_base=OUTBOX_RETRY_BASE,
+    retry_max=OUTBOX_RETRY_MAX,
+    poll_interval=OUTBOX_POLL_INTERVAL,
+    claim_lease=OUTBOX_CLAIM_LEASE,
 )
 
-# وسيط لتسجيل الطلبات وإضافة رؤوس أمان
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    response = await call_next(request)
-    
-    # إضافة رؤوس أمان
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    response.headers["Content-Security-Policy"] = "default-src 'self'; img-src 'self' data:; style-src 'self' 'unsafe-inline'; script-src 'self'"
-    
-    return response
+# موجّه المسارات؛ يُضاف إلى التطبيق في create_app
+router = APIRouter()
+
+# رؤوس الأمان المضافة إلى كل استجابة
+SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "X-XSS-Protection": "1; mode=block",
+    "Strict-Transport-Security": "max-age=31536000; includeSubDomains",
+    "Content-Security-Policy": "default-src 'self'; img-src 'self' data:; style-src 'self' 'unsafe-inline'; script-src 'self'",
+}
+
+class SecurityHeadersMiddleware:
+    """وسيط ASGI يضيف رؤوس الأمان إلى رسالة بدء الاستجابة فقط.
+
+    لا يغلف الطلب أو الاستجابة كما يفعل BaseHTTPMiddleware، فتمر أجزاء الاستجابات
+    المتدفقة وامتدادات الخادم (مثل zerocopy) كما هي.
+    """
+
+    def __init__(self, app, headers: dict = SECURITY_HEADERS):
+        self.app = app
+        self.headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+        self._names = {name for name, _ in self.headers}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                # استبدال أي قيمة سابقة لنفس الرأس كما كان يفعل الوسيط القديم
+                headers = [(name, value) for name, value in message.get("headers", ()) if name.lower() not in self._names]
+                headers.extend(self.headers)
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
 
 # معالج الأخطاء العام
-@app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"detail": "حدث خطأ داخلي في الخادم"},
     )
 
+# دورة حياة التطبيق: تجهيز المخطط وتشغيل العمال الخلفيين ثم إيقافهم قبل تفريغ طابور الكتابة
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    await run_in_threadpool(ensure_schema_once)
+    await run_in_threadpool(integrations.warm)
+    if dispatcher_publishes():
+        schedule_dispatcher.start()
+    elif SCHEDULE_DISPATCHER_ENABLED:
+        print("تحذير: موزع الجدولات مفعل دون SCHEDULE_PUBLISHER، تبقى الجدولات معلقة")
+    outbox_relay.start()
+    last_login_recorder.start()
+    startup_timings["startup"] = time.perf_counter() - started
+    print("أزمنة بدء التشغيل: " + ", ".join(
+        f"{name}={seconds * 1000:.1f}ms" for name, seconds in startup_timings.items()
+    ))
+    try:
+        yield
+    finally:
+        await schedule_dispatcher.stop()
+        await outbox_relay.stop()
+        await last_login_recorder.stop()
+        await write_queue.stop()
+        password_hasher.shutdown()
+
+# مقاييس الأداء بصيغة Prometheus
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # إن ضُبط يجب إرساله كـ Bearer لقراءة /metrics
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# [عدد الاستعلامات، زمنها] للطلب الجاري؛ تسجله أحداث المحرك ضمن سياق الطلب
+_request_db_stats = contextvars.ContextVar("request_db_stats", default=None)
+
+class RouteMetrics:
+    __slots__ = ("buckets", "count", "seconds", "db_queries", "db_seconds", "statuses")
+
+    def __init__(self, bucket_count: int):
+        self.buckets = [0] * (bucket_count + 1)  # الخانة الأخيرة لـ +Inf
+        self.count = 0
+        self.seconds = 0.0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.statuses = Counter()
+
+class MetricsRegistry:
+    """عدادات داخل العملية تُحدَّث من حلقة الأحداث دون أقفال وتُقرأ عند طلب /metrics."""
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.routes = {}  # (method, route) -> RouteMetrics
+        self.in_flight = 0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, db_stats):
+        metrics = self.routes.get((method, route))
+        if metrics is None:
+            metrics = self.routes[(method, route)] = RouteMetrics(len(self.buckets))
+        metrics.buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+        metrics.count += 1
+        metrics.seconds += seconds
+        metrics.db_queries += db_stats[0]
+        metrics.db_seconds += db_stats[1]
+        metrics.statuses[status_code] += 1
+
+    def record_query(self, seconds: float):
+        self.db_queries += 1
+        self.db_seconds += seconds
+        db_stats = _request_db_stats.get()
+        if db_stats is not None:
+            db_stats[0] += 1
+            db_stats[1] += seconds
+
+metrics_registry = MetricsRegistry()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is not None:
+        metrics_registry.record_query(time.perf_counter() - started)
+
+for _engine in (engine, async_engine.sync_engine, write_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+class MetricsMiddleware:
+    """وسيط ASGI يقيس زمن كل طلب وعدد استعلاماته ويجمعها حسب قالب المسار."""
+
+    def __init__(self, app, registry: MetricsRegistry = metrics_registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        registry = self.registry
+        registry.in_flight += 1
+        started = time.perf_counter()
+        db_stats = [0, 0.0]
+        token = _request_db_stats.set(db_stats)
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_db_stats.reset(token)
+            registry.in_flight -= 1
+            # قالب المسار (مثل /schedules/{schedule_id}) يبقي عدد السلاسل محدوداً
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            registry.observe(scope["method"], route, status_code, time.perf_counter() - started, db_stats)
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _metric_labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + "}"
+
+def render_metrics(registry: MetricsRegistry = metrics_registry) -> str:
+    lines = []
+    
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_metric_labels(**labels) if labels else ''} {value}")
+    
+    routes = sorted(registry.routes.items())
+    metric("http_requests_total", "counter", "HTTP requests by route and status.", [
+        ({"method": method, "route": route, "status": code}, count)
+        for (method, route), item in routes for code, count in sorted(item.statuses.items())
+    ])
+    histogram = []
+    for (method, route), item in routes:
+        cumulative = 0
+        for bound, count in zip(registry.buckets + (float("inf"),), item.buckets):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            histogram.append(("http_request_duration_seconds_bucket", {"method": method, "route": route, "le": le}, cumulative))
+        histogram.append(("http_request_duration_seconds_sum", {"method": method, "route": route}, item.seconds))
+        histogram.append(("http_request_duration_seconds_count", {"method": method, "route": route}, item.count))
+    lines.append("# HELP http_request_duration_seconds HTTP request latency by route.")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    lines.extend(f"{name}{_metric_labels(**labels)} {value}" for name, labels, value in histogram)
+    metric("http_requests_in_flight", "gauge", "HTTP requests currently being served.", [({}, registry.in_flight)])
+    metric("http_request_db_queries_total", "counter", "Database queries issued while serving each route.", [
+        ({"method": method, "route": route}, item.db_queries) for (method, route), item in routes
+    ])
+    metric("http_request_db_seconds_total", "counter", "Database time spent while serving each route.", [
+        ({"method": method, "route": route}, item.db_seconds) for (method, route), item in routes
+    ])
+    metric("db_queries_total", "counter", "All database queries including background workers.", [({}, registry.db_queries)])
+    metric("db_query_seconds_total", "counter", "Time spent in all database queries.", [({}, registry.db_seconds)])
+    
+    limiter = anyio.to_thread.current_default_thread_limiter().statistics()
+    metric("threadpool_threads_total", "gauge", "Worker threads available to run_in_threadpool.", [({}, limiter.total_tokens)])
+    metric("threadpool_threads_busy", "gauge", "Worker threads currently in use.", [({}, limiter.borrowed_tokens)])
+    metric("threadpool_tasks_waiting", "gauge", "Calls waiting for a free worker thread.", [({}, limiter.tasks_waiting)])
+    metric("password_hash_pending", "gauge", "Password hash operations submitted and not finished.", [({}, password_hasher.pending)])
+    metric("password_hash_queue_depth", "gauge", "Password hash operations waiting for a thread.", [({}, password_hasher.queue_depth)])
+    metric("password_hash_rejected_total", "counter", "Password hash operations rejected with 503.", [({}, password_hasher.rejected)])
+    queue_depth = write_queue._queue.qsize() if write_queue._queue is not None else 0
+    metric("write_queue_depth", "gauge", "Writes waiting for the single writer.", [({}, queue_depth)])
+    metric("write_queue_batches_total", "counter", "Batches committed by the write queue.", [({}, write_queue.batches)])
+    metric("write_queue_writes_total", "counter", "Writes committed by the write queue.", [({}, write_queue.writes)])
+    
+    caches = {"user": user_cache.stats(), "token": token_cache.stats()}
+    metric("cache_hits_total", "counter", "In-process cache hits.", [({"cache": name}, stats["hits"]) for name, stats in caches.items()])
+    metric("cache_misses_total", "counter", "In-process cache misses.", [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+    metric("cache_hit_ratio", "gauge", "In-process cache hit ratio.", [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()])
+    metric("cache_entries", "gauge", "Entries held by each in-process cache.", [({"cache": name}, stats["size"]) for name, stats in caches.items()])
+    
+    metric("schedule_dispatch_total", "counter", "Schedules handled by the in-process dispatcher.", [
+        ({"result": "completed"}, schedule_dispatcher.completed),
+        ({"result": "failed"}, schedule_dispatcher.failed),
+        ({"result": "lost_claim"}, schedule_dispatcher.lost_claims),
+    ])
+    metric("outbox_events_total", "counter", "Outbox deliveries by result.", [
+        ({"result": "delivered"}, outbox_relay.delivered),
+        ({"result": "retried"}, outbox_relay.retried),
+        ({"result": "dead"}, outbox_relay.dead),
+    ])
+    integration_stats = integrations.stats()["calls"]
+    metric("integration_calls_total", "counter", "Calls to automation integrations.", [
+        ({"call": key}, item["count"]) for key, item in sorted(integration_stats.items())
+    ])
+    metric("integration_errors_total", "counter", "Failed calls to automation integrations.", [
+        ({"call": key}, item["errors"]) for key, item in sorted(integration_stats.items())
+    ])
+    metric("integration_call_seconds_total", "counter", "Time spent in automation integration calls.", [
+        ({"call": key}, item["total_seconds"]) for key, item in sorted(integration_stats.items())
+    ])
+    metric("startup_seconds", "gauge", "Import and startup timings.", [
+        ({"phase": phase}, seconds) for phase, seconds in startup_timings.items()
+    ])
+    return "\n".join(lines) + "\n"
+
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="غير مصرح بقراءة المقاييس")
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # مسارات المصادقة
-@app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+@router.post("/token", response_model=Token)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -422,103 +2026,231 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer", "expires_at": expires_at}
 
-@app.post("/users/", response_model=UserResponse)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = get_user(db, username=user.username)
+@router.post("/users/", response_model=UserResponse)
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await get_user(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="اسم المستخدم مسجل بالفعل")
     
     # التحقق من البريد الإلكتروني
-    email_exists = db.query(User).filter(User.email == user.email).first()
+    email_exists = await get_user_by_email(db, user.email)
     if email_exists:
         raise HTTPException(status_code=400, detail="البريد الإلكتروني مسجل بالفعل")
     
-    hashed_password = get_password_hash(user.password)
-    db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    hashed_password = await password_hasher.hash(user.password)
+    return await write_queue.run(lambda session: add_and_flush(
+        session, User(username=user.username, email=user.email, hashed_password=hashed_password)
+    ))
 
-@app.get("/users/me/", response_model=UserResponse)
+@router.get("/users/me/", response_model=UserResponse)
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
 # مسارات حسابات تيك توك
-@app.post("/tiktok-accounts/", response_model=TikTokAccountResponse)
-def create_tiktok_account(
+@router.post("/tiktok-accounts/", response_model=TikTokAccountResponse)
+async def create_tiktok_account(
     account: TikTokAccountCreate, 
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # تشفير كلمة المرور قبل التخزين
-    encrypted_password = get_password_hash(account.password)
-    
-    db_account = TikTokAccount(
-        username=account.username,
-        password=encrypted_password,  # تخزين كلمة المرور المشفرة
-        country=account.country,
-        proxy=account.proxy,
-        owner_id=current_user.id
-    )
-    db.add(db_account)
-    db.commit()
-    db.refresh(db_account)
-    
-    # إذا كان نظام أتمتة تيك توك متاحًا، قم بإضافة الحساب إليه أيضًا
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        account_manager = AccountManager()
-        account_manager.add_account(
-            account.username,
-            account.password,  # استخدام كلمة المرور الأصلية للنظام الخارجي
-            account.country,
-            account.proxy
+    encrypted_password = await password_hasher.hash(account.password)
+    
+    async def insert_account(session):
+        db_account = await add_and_flush(session, TikTokAccount(
+            username=account.username,
+            password=encrypted_password,  # تخزين كلمة المرور المشفرة
+            country=account.country,
+            proxy=account.proxy,
+            owner_id=current_user.id
+        ))
+        
+        # مزامنة الحساب مع نظام أتمتة تيك توك عبر صندوق الصادر في نفس المعاملة
+        enqueue_sync(
+            session,
+            "account.add",
+            f"account:{db_account.id}",
+            username=account.username,
+            password=account.password,  # استخدام كلمة المرور الأصلية للنظام الخارجي
+            country=account.country,
+            proxy=account.proxy
         )
+        await bump_collection_versions(session, [current_user.id], "accounts")
+        changes = StatChanges()
+        changes.account(current_user.id)
+        await changes.apply(session)
+        return db_account
+    
+    db_account = await write_queue.run(insert_account)
+    outbox_relay.notify()
     
     return db_account
 
-@app.get("/tiktok-accounts/", response_model=List[TikTokAccountResponse])
-def read_tiktok_accounts(
-    skip: int = 0, 
-    limit: int = 100, 
+@router.get("/tiktok-accounts/", response_model=List[TikTokAccountResponse])
+async def read_tiktok_accounts(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0), 
+    limit: int = Query(100, ge=1, le=1000), 
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    accounts = db.query(TikTokAccount).filter(TikTokAccount.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return accounts
-
-@app.get("/tiktok-accounts/{account_id}", response_model=TikTokAccountResponse)
-def read_tiktok_account(
+    not_modified = await check_collection_etag(db, request, response, current_user.id, "accounts")
+    if not_modified:
+        return not_modified
+    query = select(TikTokAccount).where(TikTokAccount.owner_id == current_user.id)
+    return await paginate(db, query, [TikTokAccount.id], response, skip, limit, cursor)
+
+@router.get("/tiktok-accounts/{account_id}", response_model=TikTokAccountResponse)
+async def read_tiktok_account(
     account_id: int, 
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == account_id, TikTokAccount.owner_id == current_user.id).first()
+    not_modified = await check_collection_etag(db, request, response, current_user.id, "accounts")
+    if not_modified:
+        return not_modified
+    account = await get_owned_account(db, account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     return account
 
-@app.delete("/tiktok-accounts/{account_id}")
-def delete_tiktok_account(
+@router.delete("/tiktok-accounts/{account_id}")
+async def delete_tiktok_account(
     account_id: int, 
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == account_id, TikTokAccount.owner_id == current_user.id).first()
+    account = await get_owned_account(db, account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
-    # إذا كان نظام أتمتة تيك توك متاحًا، قم بإزالة الحساب منه أيضًا
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        account_manager = AccountManager()
-        account_manager.remove_account(account.username)
+    async def delete_account(session):
+        # حذف الحساب يحذف جدولاته، لذلك تُحرر فيديوهاتها في نفس المعاملة
+        # الحذف مع RETURNING يعيد حالة الصفوف لحظة حذفها فلا تنحرف العدادات إن غيّرها الموزع قبل ذلك
+        deleted = (await session.execute(
+            delete(Schedule)
+            .where(Schedule.account_id == account.id)
+            .returning(Schedule.id, Schedule.video_sha256, Schedule.video_path, Schedule.status, Schedule.schedule_time)
+        )).all()
+        # الجدولات المحذوفة مع الحساب تُزال من المجدول الخارجي أيضاً، قبل إزالة الحساب نفسه بترتيب الصادر
+        for schedule_id, *_ in deleted:
+            enqueue_sync(session, "schedule.remove", f"account:{account.id}", schedule_id=str(schedule_id))
+        # إزالة الحساب من نظام أتمتة تيك توك بعد تثبيت الحذف
+        enqueue_sync(session, "account.remove", f"account:{account.id}", username=account.username)
+        removals = await release_videos(session, [(sha256, path) for _, sha256, path, _, _ in deleted])
+        # تفاعلات الحساب تُحذف معه، فقائمة التفاعلات لم تعد تضم الحسابات لاستبعادها
+        await session.execute(delete(Engagement).where(Engagement.account_id == account.id))
+        result = await session.execute(delete(TikTokAccount).where(TikTokAccount.id == account.id))
+        if not result.rowcount:
+            # حذفه طلب آخر في الأثناء؛ رفع الاستثناء يلغي المعاملة كلها
+            raise HTTPException(status_code=404, detail="الحساب غير موجود")
+        await bump_collection_versions(session, [current_user.id], "accounts", "schedules", "engagements")
+        changes = StatChanges()
+        changes.account(current_user.id, -1)
+        for _, _, _, schedule_status, schedule_time in deleted:
+            changes.schedule(current_user.id, schedule_status, schedule_time, -1)
+        await changes.apply(session)
+        return removals
     
-    db.delete(account)
-    db.commit()
+    removals = await write_queue.run(delete_account)
+    outbox_relay.notify()
+    await remove_video_files(removals)
     return {"detail": "تم حذف الحساب بنجاح"}
 
 # مسارات جدولة المنشورات
-@app.post("/schedules/", response_model=ScheduleResponse)
+ALLOWED_VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+def validate_video_filename(filename: Optional[str]):
+    if not filename or not filename.lower().endswith(ALLOWED_VIDEO_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="نوع الملف غير مدعوم. يجب أن يكون الملف بتنسيق mp4 أو mov أو avi")
+
+def parse_schedule_time(schedule_time: str) -> datetime:
+    # تحويل وقت الجدولة إلى كائن datetime
+    try:
+        schedule_time_obj = datetime.fromisoformat(schedule_time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="تنسيق وقت الجدولة غير صالح")
+    
+    # التحقق من أن وقت الجدولة في المستقبل
+    if schedule_time_obj <= datetime.now():
+        raise HTTPException(status_code=400, detail="وقت الجدولة يجب أن يكون في المستقبل")
+    return schedule_time_obj
+
+async def create_schedules_from_staged_videos(current_user: User, account: TikTokAccount, staged: list):
+    """ينشئ جدولة لكل فيديو مرحلي في معاملة واحدة ثم ينقل الملفات إلى مخزن المحتوى.
+
+    كل عنصر: (staging_path, video_size, video_sha256, filename, caption, schedule_time_obj, tags).
+    """
+    # إنشاء الجدولات في قاعدة البيانات مع حجز مرجع على كل فيديو في نفس المعاملة
+    async def insert_schedules(session):
+        changes = StatChanges()
+        schedules = []
+        for _, video_size, video_sha256, filename, caption, schedule_time_obj, tags in staged:
+            video_path = await acquire_video_blob(
+                session, video_sha256, video_size, blob_path_for(video_sha256, filename)
+            )
+            # مزامنة الجدولة مع نظام أتمتة تيك توك عبر صندوق الصادر في نفس المعاملة
+            enqueue_sync(
+                session,
+                "schedule.add",
+                f"account:{account.id}",
+                username=account.username,
+                video_path=video_path,
+                caption=caption,
+                schedule_time=schedule_time_obj.isoformat(),
+                tags=tags
+            )
+            changes.schedule(current_user.id, "pending", schedule_time_obj)
+            schedule = Schedule(
+                video_path=video_path,
+                video_size=video_size,
+                video_sha256=video_sha256,
+                caption=caption,
+                schedule_time=schedule_time_obj,
+                tags=tags,
+                status="pending",
+                owner_id=current_user.id,
+                account_id=account.id
+            )
+            session.add(schedule)
+            schedules.append(schedule)
+        await bump_collection_versions(session, [current_user.id], "schedules")
+        await changes.apply(session)
+        await session.flush()
+        return schedules
+    
+    try:
+        db_schedules = await write_queue.run(insert_schedules)
+    except BaseException:
+        for staging_path, *_ in staged:
+            await run_in_threadpool(discard_staged_file, staging_path)
+        raise
+    for (staging_path, *_), db_schedule in zip(staged, db_schedules):
+        await run_in_threadpool(place_blob_file, staging_path, db_schedule.video_path)
+        schedule_dispatcher.notify(db_schedule.id, db_schedule.schedule_time)
+    outbox_relay.notify()
+    
+    return db_schedules
+
+async def create_schedule_from_staged_video(
+    current_user: User,
+    account: TikTokAccount,
+    staging_path: str,
+    video_size: int,
+    video_sha256: str,
+    filename: str,
+    caption: str,
+    schedule_time_obj: datetime,
+    tags: Optional[str],
+):
+    staged = [(staging_path, video_size, video_sha256, filename, caption, schedule_time_obj, tags)]
+    return (await create_schedules_from_staged_videos(current_user, account, staged))[0]
+
+@router.post("/schedules/", response_model=ScheduleResponse)
 async def create_schedule(
     caption: str = Form(...),
     schedule_time: str = Form(...),
@@ -526,370 +2258,1469 @@ async def create_schedule(
     account_id: int = Form(...),
     video: UploadFile = File(...),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من وجود الحساب
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == account_id, TikTokAccount.owner_id == current_user.id).first()
+    account = await get_owned_account(db, account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
-    # التحقق من نوع الملف
-    if not video.filename.lower().endswith(('.mp4', '.mov', '.avi')):
-        raise HTTPException(status_code=400, detail="نوع الملف غير مدعوم. يجب أن يكون الملف بتنسيق mp4 أو mov أو avi")
-    
-    # حفظ الفيديو
-    upload_dir = os.path.join("uploads", str(current_user.id))
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # استخدام اسم ملف آمن
-    safe_filename = f"{secrets.token_hex(8)}_{os.path.basename(video.filename)}"
-    file_path = os.path.join(upload_dir, safe_filename)
+    # التحقق من نوع الملف ووقت الجدولة قبل كتابة أي بايت على القرص
+    validate_video_filename(video.filename)
+    schedule_time_obj = parse_schedule_time(schedule_time)
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(video.file, buffer)
+    # حفظ الفيديو في منطقة مؤقتة؛ اسمه النهائي يُشتق من بصمة محتواه
+    staging_path, video_size, video_sha256 = await stage_upload(video)
+    return await create_schedule_from_staged_video(
+        current_user, account, staging_path, video_size, video_sha256, video.filename,
+        caption, schedule_time_obj, tags
+    )
+
+# إنشاء عدة جدولات لحساب واحد في طلب واحد: تحقق مسبق ثم معاملة واحدة
+SCHEDULE_BATCH_MAX_ITEMS = int(os.environ.get("SCHEDULE_BATCH_MAX_ITEMS", "50"))
+SCHEDULE_BATCH_MAX_TOTAL_SIZE = int(os.environ.get("SCHEDULE_BATCH_MAX_TOTAL_MB", "1024")) * 1024 * 1024
+
+def batch_too_large_exception():
+    return HTTPException(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        detail=f"الحجم الإجمالي للدفعة يتجاوز الحد المسموح ({SCHEDULE_BATCH_MAX_TOTAL_SIZE // (1024 * 1024)} ميغابايت)",
+    )
+
+def validation_error_detail(exc: ValidationError) -> str:
+    # رسالة قصيرة لكل حقل بدلاً من نص pydantic الكامل
+    messages = []
+    for error in exc.errors():
+        field = ".".join(str(part) for part in error["loc"])
+        messages.append(f"{field}: {error['msg']}" if field else error["msg"])
+    return "بيانات العنصر غير صالحة: " + "; ".join(messages)
+
+def validate_batch_item(raw, video: UploadFile):
+    try:
+        item = ScheduleBatchItem.parse_obj(raw)
+    except ValidationError as exc:
+        raise HTTPException(status_code=400, detail=validation_error_detail(exc))
+    validate_video_filename(video.filename)
+    return item, parse_schedule_time(item.schedule_time)
+
+@router.post("/schedules/batch", response_model=List[ScheduleBatchResult])
+async def create_schedules_batch(
+    account_id: int = Form(...),
+    items: str = Form(...),  # مصفوفة JSON من {caption, schedule_time, tags} بترتيب ملفات videos
+    videos: List[UploadFile] = File(...),
+    atomic: bool = Form(True),  # false: تُنشأ العناصر الصالحة ويُبلَّغ عن الباقي
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # التحقق من وجود الحساب
+    account = await get_owned_account(db, account_id, current_user.id)
+    if account is None:
+        raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
-    # تحويل وقت الجدولة إلى كائن datetime
     try:
-        schedule_time_obj = datetime.fromisoformat(schedule_time)
-        
-        # التحقق من أن وقت الجدولة في المستقبل
-        if schedule_time_obj <= datetime.now():
-            raise HTTPException(status_code=400, detail="وقت الجدولة يجب أن يكون في المستقبل")
+        raw_items = json.loads(items)
     except ValueError:
-        raise HTTPException(status_code=400, detail="تنسيق وقت الجدولة غير صالح")
+        raise HTTPException(status_code=400, detail="قائمة العناصر ليست JSON صالحاً")
+    if not isinstance(raw_items, list) or len(raw_items) != len(videos):
+        raise HTTPException(status_code=400, detail="عدد العناصر يجب أن يساوي عدد ملفات الفيديو")
+    if not 1 <= len(raw_items) <= SCHEDULE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"عدد العناصر يجب أن يكون بين 1 و {SCHEDULE_BATCH_MAX_ITEMS}")
+    if sum(video.size or 0 for video in videos) > SCHEDULE_BATCH_MAX_TOTAL_SIZE:
+        raise batch_too_large_exception()
     
-    # إنشاء الجدولة في قاعدة البيانات
-    db_schedule = Schedule(
-        video_path=file_path,
-        caption=caption,
-        schedule_time=schedule_time_obj,
-        tags=tags,
-        owner_id=current_user.id,
-        account_id=account_id
-    )
-    db.add(db_schedule)
-    db.commit()
-    db.refresh(db_schedule)
-    
-    # إذا كان نظام أتمتة تيك توك متاحًا، قم بإضافة الجدولة إليه أيضًا
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        schedule_manager = ScheduleManager()
-        schedule_manager.add_post(
-            account.username,
-            file_path,
-            caption,
-            schedule_time,
-            tags
-        )
+    # التحقق من كل العناصر قبل كتابة أي بايت على القرص
+    results = [{"index": index, "status": "created", "schedule": None, "error": None} for index in range(len(raw_items))]
+    valid = []
+    for index, (raw, video) in enumerate(zip(raw_items, videos)):
+        try:
+            item, schedule_time_obj = validate_batch_item(raw, video)
+        except HTTPException as exc:
+            results[index].update(status="failed", error=exc.detail)
+        else:
+            valid.append((index, video, item, schedule_time_obj))
+    if atomic and len(valid) < len(raw_items):
+        for result in results:
+            if result["status"] == "created":
+                result["status"] = "skipped"
+        raise HTTPException(status_code=400, detail=results)
     
-    return db_schedule
-
-@app.get("/schedules/", response_model=List[ScheduleResponse])
-def read_schedules(
-    skip: int = 0, 
-    limit: int = 100, 
+    # حفظ الفيديوهات في منطقة مؤقتة بالتتابع؛ فشل أحدها يلغي الدفعة في الوضع الذري
+    staged = []
+    staged_indexes = []
+    staged_size = 0
+    try:
+        for index, video, item, schedule_time_obj in valid:
+            try:
+                staging_path, video_size, video_sha256 = await stage_upload(video)
+            except HTTPException as exc:
+                if atomic:
+                    raise
+                results[index].update(status="failed", error=exc.detail)
+                continue
+            staged.append((staging_path, video_size, video_sha256, video.filename,
+                           item.caption, schedule_time_obj, item.tags))
+            staged_indexes.append(index)
+            # الحجم المعلن قد يغيب، فيُحسب المجموع الفعلي أثناء الحفظ أيضاً
+            staged_size += video_size
+            if staged_size > SCHEDULE_BATCH_MAX_TOTAL_SIZE:
+                raise batch_too_large_exception()
+    except BaseException:
+        for staging_path, *_ in staged:
+            await run_in_threadpool(discard_staged_file, staging_path)
+        raise
+    
+    if staged:
+        db_schedules = await create_schedules_from_staged_videos(current_user, account, staged)
+        for index, db_schedule in zip(staged_indexes, db_schedules):
+            results[index]["schedule"] = db_schedule
+    return results
+
+@router.get("/schedules/", response_model=List[ScheduleResponse])
+async def read_schedules(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0), 
+    limit: int = Query(100, ge=1, le=1000), 
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    schedules = db.query(Schedule).filter(Schedule.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return schedules
-
-@app.get("/schedules/{schedule_id}", response_model=ScheduleResponse)
-def read_schedule(
+    not_modified = await check_collection_etag(db, request, response, current_user.id, "schedules")
+    if not_modified:
+        return not_modified
+    query = select(Schedule).where(Schedule.owner_id == current_user.id)
+    return await paginate(db, query, [Schedule.schedule_time, Schedule.id], response, skip, limit, cursor)
+
+# تقويم الجدولات: عدد الجدولات لكل يوم أو ساعة ضمن نطاق زمني باستعلام واحد على الفهرس المغطي
+CALENDAR_BUCKETS = {"day": "%Y-%m-%d", "hour": "%Y-%m-%d %H:00:00"}
+CALENDAR_MAX_RANGE = {"day": timedelta(days=366), "hour": timedelta(days=31)}
+
+def calendar_bucket_column(bucket: str):
+    if SQLALCHEMY_DATABASE_URL.startswith("postgresql"):
+        return func.date_trunc(bucket, Schedule.schedule_time)
+    return func.strftime(CALENDAR_BUCKETS[bucket], Schedule.schedule_time)
+
+def local_naive(value: datetime) -> datetime:
+    # أوقات الجدولة مخزنة بالتوقيت المحلي دون منطقة زمنية
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+@router.get("/schedules/calendar", response_model=List[CalendarBucket])
+async def read_schedule_calendar(
+    request: Request,
+    response: Response,
+    start: datetime,
+    end: datetime,
+    bucket: str = "day",
+    account_id: Optional[int] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if bucket not in CALENDAR_BUCKETS:
+        raise HTTPException(status_code=400, detail="وحدة التجميع يجب أن تكون day أو hour")
+    if status_filter is not None and status_filter not in SCHEDULE_STATUSES:
+        raise HTTPException(status_code=400, detail="حالة الجدولة غير صالحة")
+    start, end = local_naive(start), local_naive(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="نهاية النطاق يجب أن تكون بعد بدايته")
+    if end - start > CALENDAR_MAX_RANGE[bucket]:
+        raise HTTPException(status_code=400, detail="النطاق الزمني أطول من المسموح لوحدة التجميع")
+    
+    not_modified = await check_collection_etag(db, request, response, current_user.id, "schedules")
+    if not_modified:
+        return not_modified
+    
+    bucket_column = calendar_bucket_column(bucket).label("bucket")
+    query = (
+        select(bucket_column, Schedule.status, func.count())
+        .where(
+            Schedule.owner_id == current_user.id,
+            Schedule.schedule_time >= start,
+            Schedule.schedule_time < end,
+        )
+        .group_by(bucket_column, Schedule.status)
+        .order_by(bucket_column)
+    )
+    if account_id is not None:
+        query = query.where(Schedule.account_id == account_id)
+    if status_filter is not None:
+        query = query.where(Schedule.status == status_filter)
+    
+    buckets = {}
+    for bucket_start, schedule_status, count in (await db.execute(query)).all():
+        if isinstance(bucket_start, str):
+            bucket_start = datetime.fromisoformat(bucket_start)
+        row = buckets.setdefault(bucket_start, {"start": bucket_start, "total": 0, "statuses": {}})
+        row["total"] += count
+        row["statuses"][schedule_status] = count
+    return list(buckets.values())
+
+@router.get("/schedules/{schedule_id}", response_model=ScheduleResponse)
+async def read_schedule(
     schedule_id: int, 
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    schedule = db.query(Schedule).filter(Schedule.id == schedule_id, Schedule.owner_id == current_user.id).first()
+    not_modified = await check_collection_etag(db, request, response, current_user.id, "schedules")
+    if not_modified:
+        return not_modified
+    result = await db.execute(
+        select(Schedule).where(Schedule.id == schedule_id, Schedule.owner_id == current_user.id)
+    )
+    schedule = result.scalars().first()
     if schedule is None:
         raise HTTPException(status_code=404, detail="الجدولة غير موجودة")
     return schedule
 
-@app.delete("/schedules/{schedule_id}")
-def delete_schedule(
+@router.delete("/schedules/{schedule_id}")
+async def delete_schedule(
     schedule_id: int, 
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    schedule = db.query(Schedule).filter(Schedule.id == schedule_id, Schedule.owner_id == current_user.id).first()
+    result = await db.execute(
+        select(Schedule).where(Schedule.id == schedule_id, Schedule.owner_id == current_user.id)
+    )
+    schedule = result.scalars().first()
     if schedule is None:
         raise HTTPException(status_code=404, detail="الجدولة غير موجودة")
     
-    # إذا كان نظام أتمتة تيك توك متاحًا، قم بإزالة الجدولة منه أيضًا
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        schedule_manager = ScheduleManager()
-        schedule_manager.remove_post(str(schedule_id))
+    async def delete_row(session):
+        deleted = (await session.execute(
+            delete(Schedule).where(Schedule.id == schedule.id).returning(Schedule.status, Schedule.schedule_time)
+        )).first()
+        if deleted is None:
+            # حذفها طلب آخر في الأثناء؛ رفع الاستثناء يلغي المعاملة كلها
+            raise HTTPException(status_code=404, detail="الجدولة غير موجودة")
+        # إزالة الجدولة من نظام أتمتة تيك توك بعد تثبيت الحذف
+        enqueue_sync(session, "schedule.remove", f"account:{schedule.account_id}", schedule_id=str(schedule_id))
+        removals = await release_videos(session, [(schedule.video_sha256, schedule.video_path)])
+        await bump_collection_versions(session, [current_user.id], "schedules")
+        changes = StatChanges()
+        changes.schedule(current_user.id, deleted.status, deleted.schedule_time, -1)
+        await changes.apply(session)
+        return removals
     
-    db.delete(schedule)
-    db.commit()
+    removals = await write_queue.run(delete_row)
+    outbox_relay.notify()
+    await remove_video_files(removals)
     return {"detail": "تم حذف الجدولة بنجاح"}
 
+# موزع الجدولات المدمج: ينشر الجدولات المستحقة من داخل العملية دون استطلاع دوري
+# معطل افتراضياً: النشر يتولاه مجدول نظام الأتمتة الخارجي عبر schedule.add في صندوق الصادر
+SCHEDULE_DISPATCHER_ENABLED = os.environ.get("SCHEDULE_DISPATCHER_ENABLED", "false").lower() == "true"
+# دالة النشر بصيغة module:function، تستقبل (username, video_path, caption, tags) وتعيد True عند النجاح
+SCHEDULE_PUBLISHER = os.environ.get("SCHEDULE_PUBLISHER", "")
+SCHEDULE_DISPATCH_BATCH = int(os.environ.get("SCHEDULE_DISPATCH_BATCH", "256"))
+SCHEDULE_DISPATCH_CONCURRENCY = int(os.environ.get("SCHEDULE_DISPATCH_CONCURRENCY", "4"))
+SCHEDULE_RESCAN_INTERVAL = float(os.environ.get("SCHEDULE_RESCAN_INTERVAL", "300"))  # لالتقاط جدولات العمليات الأخرى
+SCHEDULE_CLAIM_LEASE = float(os.environ.get("SCHEDULE_CLAIM_LEASE_MINUTES", "30")) * 60
+
+def load_schedule_publisher():
+    if not SCHEDULE_PUBLISHER:
+        return None
+    module_name, _, attr = SCHEDULE_PUBLISHER.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+schedule_publisher = load_schedule_publisher()
+
+def dispatcher_publishes() -> bool:
+    # للنشر مالك واحد: إن تولاه الموزع لا تُرسل الجدولات إلى المجدول الخارجي
+    return SCHEDULE_DISPATCHER_ENABLED and schedule_publisher is not None
+
+async def publish_schedule(schedule: Schedule, account: TikTokAccount) -> bool:
+    return await run_in_threadpool(
+        schedule_publisher, account.username, schedule.video_path, schedule.caption, schedule.tags
+    )
+
+class ScheduleDispatcher:
+    """يحتفظ بالجدولات القادمة في كومة مرتبة بالوقت ويستيقظ عند موعد أقربها.
+
+    تُحمَّل الصفوف على دفعات من فهرس (status, schedule_time)، وتُحجز كل جدولة بتحديث
+    شرطي قبل نشرها حتى لا ينشرها عاملان معاً.
+    """
+
+    def __init__(self, session_factory, handler, batch_size=256, concurrency=4,
+                 rescan_interval=300.0, claim_lease=1800.0):
+        self.session_factory = session_factory
+        self.handler = handler
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rescan_interval = rescan_interval
+        self.claim_lease = claim_lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.dispatched = 0
+        self.completed = 0
+        self.failed = 0
+        self.lost_claims = 0
+        self._task = None
+        self._wakeup = None
+        self._slots = None
+        self._running = set()
+        self._reset()
+
+    def _reset(self):
+        self._heap = []  # (schedule_time, id)
+        self._queued = set()
+        self._cursor = None  # آخر (schedule_time, id) تم تحميله
+        self._exhausted = False
+        self._next_rescan = 0.0
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._reset()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # عمليات النشر الجارية تُكمل وتسجل حالتها قبل إغلاق طابور الكتابة
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def notify(self, schedule_id: int, schedule_time: datetime):
+        # يُستدعى بعد تثبيت جدولة جديدة في هذه العملية
+        if self._task is None or self._task.done():
+            return
+        key = (schedule_time, schedule_id)
+        if not self._exhausted and (self._cursor is None or key > self._cursor):
+            return  # ستصل مع الدفعة التالية من الفهرس
+        self._push(key)
+        self._wakeup.set()
+
+    def _push(self, key):
+        if key[1] not in self._queued:
+            self._queued.add(key[1])
+            heapq.heappush(self._heap, key)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"خطأ في موزع الجدولات: {exc}")
+                await asyncio.sleep(5)
+
+    async def _step(self):
+        if time.monotonic() >= self._next_rescan:
+            await self._expire_claims()
+            self._cursor = None
+            self._exhausted = False
+            self._next_rescan = time.monotonic() + self.rescan_interval
+        
+        if self._needs_batch():
+            await self._load_batch()
+            return
+        
+        now = datetime.now()
+        while self._heap and self._heap[0][0] <= now:
+            _, schedule_id = heapq.heappop(self._heap)
+            await self._slots.acquire()
+            task = asyncio.get_running_loop().create_task(self._dispatch(schedule_id))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        if self._needs_batch():
+            return
+        
+        self._wakeup.clear()
+        timeout = self._next_rescan - time.monotonic()
+        if self._heap:
+            timeout = min(timeout, (self._heap[0][0] - datetime.now()).total_seconds())
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    def _needs_batch(self):
+        # الكومة تغطي كل ما قبل المؤشر؛ ما بعده يُحمَّل عندما يصبح أقرب من رأس الكومة
+        if self._exhausted:
+            return False
+        return not self._heap or self._cursor is None or self._heap[0] > self._cursor
+
+    async def _load_batch(self):
+        query = select(Schedule.schedule_time, Schedule.id).where(Schedule.status == "pending")
+        if self._cursor is not None:
+            query = query.where(tuple_(Schedule.schedule_time, Schedule.id) > tuple_(*self._cursor))
+        query = query.order_by(Schedule.schedule_time, Schedule.id).limit(self.batch_size)
+        async with self.session_factory() as session:
+            rows = (await session.execute(query)).all()
+        for schedule_time, schedule_id in rows:
+            self._push((schedule_time, schedule_id))
+        if rows:
+            self._cursor = (rows[-1][0], rows[-1][1])
+        self._exhausted = len(rows) < self.batch_size
+
+    async def _expire_claims(self):
+        # حجز لم يُحسم خلال مدة الإيجار يعني أن العامل توقف أثناء النشر؛ لا يُعاد النشر تجنباً للتكرار
+        cutoff = datetime.utcnow() - timedelta(seconds=self.claim_lease)
+        
+        async def expire(session):
+            result = await session.execute(
+                update(Schedule)
+                .where(Schedule.status == "processing", Schedule.claimed_at < cutoff)
+                .values(status="failed")
+                .returning(Schedule.owner_id, Schedule.schedule_time)
+            )
+            expired = result.all()
+            await bump_collection_versions(session, [owner_id for owner_id, _ in expired], "schedules")
+            changes = StatChanges()
+            for owner_id, schedule_time in expired:
+                changes.move_schedule(owner_id, schedule_time, "processing", "failed")
+            await changes.apply(session)
+        
+        await write_queue.run(expire)
+
+    async def _claim(self, schedule_id: int):
+        now = datetime.now()
+        
+        async def claim(session):
+            result = await session.execute(
+                update(Schedule)
+                .where(Schedule.id == schedule_id, Schedule.status == "pending", Schedule.schedule_time <= now)
+                .values(status="processing", claimed_at=datetime.utcnow(), claimed_by=self.worker_id)
+                .returning(Schedule.owner_id, Schedule.schedule_time)
+            )
+            claimed = result.first()
+            if claimed is None:
+                return False
+            await bump_collection_versions(session, [claimed.owner_id], "schedules")
+            changes = StatChanges()
+            changes.move_schedule(claimed.owner_id, claimed.schedule_time, "pending", "processing")
+            await changes.apply(session)
+            return True
+        
+        if not await write_queue.run(claim):
+            return None
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Schedule, TikTokAccount)
+                .join(TikTokAccount, Schedule.account_id == TikTokAccount.id)
+                .where(Schedule.id == schedule_id)
+            )
+            return result.first()
+
+    async def _finish(self, schedule_id: int, new_status: str):
+        async def finish(session):
+            result = await session.execute(
+                update(Schedule)
+                .where(Schedule.id == schedule_id, Schedule.status == "processing", Schedule.claimed_by == self.worker_id)
+                .values(status=new_status)
+                .returning(Schedule.owner_id, Schedule.schedule_time)
+            )
+            finished = result.first()
+            if finished is None:
+                return
+            await bump_collection_versions(session, [finished.owner_id], "schedules")
+            changes = StatChanges()
+            changes.move_schedule(finished.owner_id, finished.schedule_time, "processing", new_status)
+            await changes.apply(session)
+        
+        await write_queue.run(finish)
+
+    async def _dispatch(self, schedule_id: int):
+        try:
+            claimed = await self._claim(schedule_id)
+            if claimed is None:
+                self.lost_claims += 1
+                return
+            schedule, account = claimed
+            self.dispatched += 1
+            try:
+                success = await self.handler(schedule, account)
+            except Exception as exc:
+                print(f"فشل نشر الجدولة {schedule_id}: {exc}")
+                success = False
+            await self._finish(schedule_id, "completed" if success else "failed")
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+        except Exception as exc:
+            print(f"خطأ في تنفيذ الجدولة {schedule_id}: {exc}")
+        finally:
+            self._queued.discard(schedule_id)
+            self._slots.release()
+
+schedule_dispatcher = ScheduleDispatcher(
+    AsyncSessionLocal,
+    publish_schedule,
+    batch_size=SCHEDULE_DISPATCH_BATCH,
+    concurrency=SCHEDULE_DISPATCH_CONCURRENCY,
+    rescan_interval=SCHEDULE_RESCAN_INTERVAL,
+    claim_lease=SCHEDULE_CLAIM_LEASE,
+)
+
+# معاينة الفيديو المجدول مع دعم طلبات Range
+VIDEO_STREAM_CHUNK_SIZE = int(os.environ.get("VIDEO_STREAM_CHUNK_SIZE_KB", "256")) * 1024
+# عند التشغيل خلف Nginx: يرسل Nginx الملف بنفسه عبر sendfile (مثال: /protected-uploads/)
+VIDEO_ACCEL_REDIRECT_PREFIX = os.environ.get("VIDEO_ACCEL_REDIRECT_PREFIX")
+
+def parse_byte_range(range_header: str, file_size: int):
+    """يعيد (البداية، النهاية) لنطاق واحد، أو None لتجاهل الترويسة وإرسال الملف كاملاً."""
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_text, _, end_text = ranges.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+        else:
+            # نطاق لاحقة: آخر N بايت
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError(range_header)
+            start = max(0, file_size - suffix)
+            end = file_size - 1
+    except ValueError:
+        return None
+    if end_text and start_text and start > end:
+        # نطاق غير صالح نحوياً يُتجاهل ويُرسل الملف كاملاً (RFC 9110 §14.1.1)
+        return None
+    if start >= file_size:
+        raise HTTPException(
+            status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+            detail="النطاق المطلوب غير صالح",
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    return start, min(end, file_size - 1)
+
+class VideoFileResponse(Response):
+    """يرسل جزءاً من ملف دون تحميله في الذاكرة، وبدون نسخ عند دعم الخادم لامتداد zerocopy."""
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        count = self.end - self.start + 1
+        with open(self.path, "rb") as video:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": video,
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+                return
+            offset = self.start
+            more_body = True
+            while more_body:
+                chunk = b""
+                if count > 0:
+                    chunk = await run_in_threadpool(os.pread, video.fileno(), min(VIDEO_STREAM_CHUNK_SIZE, count), offset)
+                offset += len(chunk)
+                count -= len(chunk)
+                # ملف أقصر من المتوقع ينهي الاستجابة بدلاً من تعليق العميل
+                more_body = bool(chunk) and count > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+def video_etag(schedule: Schedule, stat_result) -> str:
+    # الفيديو المعنون بالمحتوى له وسم قوي ثابت هو بصمته
+    if schedule.video_sha256 and is_blob_path(schedule.video_path):
+        return f'"{schedule.video_sha256}"'
+    return f'"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+
+@router.api_route("/schedules/{schedule_id}/video", methods=["GET", "HEAD"])
+async def stream_schedule_video(
+    schedule_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    result = await db.execute(
+        select(Schedule).where(Schedule.id == schedule_id, Schedule.owner_id == current_user.id)
+    )
+    schedule = result.scalars().first()
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="الجدولة غير موجودة")
+    try:
+        stat_result = await run_in_threadpool(os.stat, schedule.video_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="ملف الفيديو غير موجود")
+    
+    etag = video_etag(schedule, stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    
+    # الطلبات الشرطية: لا حاجة لإرسال الملف إن لم يتغير
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if not request.headers.get("if-none-match") and request.headers.get("if-modified-since"):
+        try:
+            if int(parsedate_to_datetime(request.headers["if-modified-since"]).timestamp()) >= int(stat_result.st_mtime):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    
+    if VIDEO_ACCEL_REDIRECT_PREFIX:
+        # Nginx يتولى النطاقات والإرسال بدون نسخ من الموقع الداخلي
+        relative_path = os.path.relpath(schedule.video_path, UPLOAD_ROOT).replace(os.sep, "/")
+        headers["X-Accel-Redirect"] = VIDEO_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative_path
+        return Response(headers=headers)
+    
+    file_size = stat_result.st_size
+    media_type = mimetypes.guess_type(schedule.video_path)[0] or "application/octet-stream"
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and file_size and (not if_range or if_range in (etag, last_modified)):
+        byte_range = parse_byte_range(range_header, file_size)
+    
+    if byte_range is None:
+        return VideoFileResponse(schedule.video_path, 0, file_size - 1, 200, headers, media_type)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    return VideoFileResponse(schedule.video_path, start, end, status.HTTP_206_PARTIAL_CONTENT, headers, media_type)
+
+# مسارات الرفع القابل للاستئناف
+UPLOAD_SESSION_TTL = timedelta(hours=float(os.environ.get("UPLOAD_SESSION_TTL_HOURS", "24")))
+UPLOAD_WRITER_LEASE = timedelta(seconds=float(os.environ.get("UPLOAD_WRITER_LEASE_SECONDS", "300")))
+
+def _create_empty_file(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+def _open_for_append(path: str, offset: int):
+    buffer = open(path, "r+b")
+    buffer.seek(offset)
+    buffer.truncate()  # إسقاط أي بايتات لم يتم تأكيدها من محاولة سابقة
+    return buffer
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as buffer:
+        for chunk in iter(lambda: buffer.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def expire_upload_sessions(limit: int = 100):
+    # تنظيف كسول للجلسات المنتهية عند إنشاء جلسة جديدة؛ الملفات تُحذف بعد تثبيت حذف صفوفها
+    expired_ids = select(UploadSession.id).where(UploadSession.expires_at < datetime.utcnow()).limit(limit)
+    
+    async def delete_expired(session):
+        return (await session.execute(
+            delete(UploadSession).where(UploadSession.id.in_(expired_ids)).returning(UploadSession.temp_path)
+        )).scalars().all()
+    
+    for temp_path in await write_queue.run(delete_expired):
+        await run_in_threadpool(discard_staged_file, temp_path)
+
+async def get_owned_upload_session(db: AsyncSession, upload_id: str, owner_id: int):
+    upload_session = await db.get(UploadSession, upload_id)
+    if upload_session is None or upload_session.owner_id != owner_id:
+        raise HTTPException(status_code=404, detail="جلسة الرفع غير موجودة")
+    now = datetime.utcnow()
+    if upload_session.expires_at < now:
+        result = await write_queue.run(lambda session: session.execute(
+            delete(UploadSession).where(UploadSession.id == upload_id, UploadSession.expires_at < now)
+        ))
+        if result.rowcount:
+            await run_in_threadpool(discard_staged_file, upload_session.temp_path)
+        raise HTTPException(status_code=404, detail="انتهت صلاحية جلسة الرفع")
+    return upload_session
+
+def upload_progress_headers(upload_session: UploadSession, response: Response):
+    response.headers["Upload-Offset"] = str(upload_session.received)
+    response.headers["Upload-Length"] = str(upload_session.total_size)
+
+@router.post("/uploads/", response_model=UploadSessionResponse)
+async def create_upload_session(
+    upload: UploadSessionCreate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    validate_video_filename(upload.filename)
+    if upload.size > MAX_UPLOAD_SIZE:
+        raise upload_too_large_exception()
+    
+    await expire_upload_sessions()
+    
+    upload_id = secrets.token_urlsafe(24)
+    temp_path = os.path.join(STAGING_ROOT, f"{upload_id}.upload")
+    await run_in_threadpool(_create_empty_file, temp_path)
+    return await write_queue.run(lambda session: add_and_flush(session, UploadSession(
+        id=upload_id,
+        owner_id=current_user.id,
+        filename=os.path.basename(upload.filename),
+        total_size=upload.size,
+        received=0,
+        temp_path=temp_path,
+        expires_at=datetime.utcnow() + UPLOAD_SESSION_TTL
+    )))
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def read_upload_session(
+    upload_id: str,
+    response: Response,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    upload_session = await get_owned_upload_session(db, upload_id, current_user.id)
+    upload_progress_headers(upload_session, response)
+    return upload_session
+
+@router.put("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    upload_session = await get_owned_upload_session(db, upload_id, current_user.id)
+    # يجب أن يبدأ الجزء من آخر إزاحة مؤكدة، وإلا يعيد العميل المحاولة من الإزاحة الحالية
+    if upload_offset != upload_session.received:
+        upload_progress_headers(upload_session, response)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"الإزاحة غير متطابقة، الإزاحة الحالية {upload_session.received}",
+            headers={"Upload-Offset": str(upload_session.received)},
+        )
+    
+    # حجز الجلسة قبل لمس الملف، فلا يكتب طلب ثانٍ متزامن أي بايت
+    writer = secrets.token_urlsafe(16)
+    claimed_at = datetime.utcnow()
+    lease_until = claimed_at + UPLOAD_WRITER_LEASE
+    claim = await write_queue.run(lambda session: session.execute(
+        update(UploadSession)
+        .where(
+            UploadSession.id == upload_id,
+            UploadSession.received == upload_offset,
+            or_(UploadSession.writer.is_(None), UploadSession.writer_expires_at < claimed_at),
+        )
+        .values(writer=writer, writer_expires_at=lease_until)
+    ))
+    if not claim.rowcount:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="جلسة الرفع قيد الكتابة من طلب آخر",
+            headers={"Upload-Offset": str(upload_session.received)},
+        )
+    
+    async def release_writer():
+        await write_queue.run(lambda session: session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == upload_id, UploadSession.writer == writer)
+            .values(writer=None, writer_expires_at=None)
+        ))
+    
+    received = upload_session.received
+    too_large = False
+    try:
+        buffer = await run_in_threadpool(_open_for_append, upload_session.temp_path, received)
+        pending = bytearray()
+        try:
+            async for chunk in request.stream():
+                if received + len(pending) + len(chunk) > upload_session.total_size:
+                    too_large = True
+                    break
+                pending.extend(chunk)
+                if len(pending) >= UPLOAD_CHUNK_SIZE:
+                    # بعد انتهاء العقد قد يحجز طلب آخر الجلسة، فنتوقف ونثبت ما كُتب حتى الآن
+                    if datetime.utcnow() >= lease_until:
+                        pending.clear()
+                        break
+                    await run_in_threadpool(buffer.write, bytes(pending))
+                    received += len(pending)
+                    pending.clear()
+        except ClientDisconnect:
+            # حفظ ما وصل قبل انقطاع الاتصال حتى يستأنف العميل منه
+            pass
+        finally:
+            if pending and datetime.utcnow() < lease_until:
+                await run_in_threadpool(buffer.write, bytes(pending))
+                received += len(pending)
+            await run_in_threadpool(_finish_file, buffer)
+    except BaseException:
+        await release_writer()
+        raise
+    
+    # تثبيت التقدم وتحرير الجلسة فقط إن بقي العقد لهذا الطلب
+    expires_at = datetime.utcnow() + UPLOAD_SESSION_TTL
+    result = await write_queue.run(lambda session: session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload_id, UploadSession.writer == writer)
+        .values(received=received, expires_at=expires_at, writer=None, writer_expires_at=None)
+    ))
+    if not result.rowcount:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="تم تحديث جلسة الرفع من طلب آخر")
+    if too_large:
+        raise HTTPException(
+            status_code=400,
+            detail="البيانات المرسلة تتجاوز حجم الملف المعلن",
+            headers={"Upload-Offset": str(received)},
+        )
+    
+    upload_session.received = received
+    upload_session.expires_at = expires_at
+    upload_progress_headers(upload_session, response)
+    return upload_session
+
+@router.post("/uploads/{upload_id}/finalize", response_model=ScheduleResponse)
+async def finalize_upload(
+    upload_id: str,
+    caption: str = Form(...),
+    schedule_time: str = Form(...),
+    tags: Optional[str] = Form(None),
+    account_id: int = Form(...),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    upload_session = await get_owned_upload_session(db, upload_id, current_user.id)
+    if upload_session.received != upload_session.total_size:
+        raise HTTPException(
+            status_code=409,
+            detail="لم يكتمل رفع الملف بعد",
+            headers={"Upload-Offset": str(upload_session.received)},
+        )
+    
+    # التحقق من وجود الحساب
+    account = await get_owned_account(db, account_id, current_user.id)
+    if account is None:
+        raise HTTPException(status_code=404, detail="الحساب غير موجود")
+    schedule_time_obj = parse_schedule_time(schedule_time)
+    
+    # إزالة الجلسة قبل إنشاء الجدولة حتى لا يُستخدم نفس الملف مرتين
+    result = await write_queue.run(lambda session: session.execute(
+        delete(UploadSession).where(UploadSession.id == upload_id)
+    ))
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="جلسة الرفع غير موجودة")
+    
+    video_sha256 = await run_in_threadpool(_hash_file, upload_session.temp_path)
+    return await create_schedule_from_staged_video(
+        current_user, account, upload_session.temp_path, upload_session.total_size, video_sha256,
+        upload_session.filename, caption, schedule_time_obj, tags
+    )
+
+@router.delete("/uploads/{upload_id}")
+async def cancel_upload_session(
+    upload_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    upload_session = await get_owned_upload_session(db, upload_id, current_user.id)
+    result = await write_queue.run(lambda session: session.execute(
+        delete(UploadSession).where(UploadSession.id == upload_id)
+    ))
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="جلسة الرفع غير موجودة")
+    await run_in_threadpool(discard_staged_file, upload_session.temp_path)
+    return {"detail": "تم إلغاء جلسة الرفع"}
+
 # مسارات البروكسي
-@app.post("/proxies/", response_model=ProxyResponse)
-def create_proxy(
+@router.post("/proxies/", response_model=ProxyResponse)
+async def create_proxy(
     proxy: ProxyCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من صلاحيات المستخدم
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="ليس لديك صلاحية لإضافة بروكسي")
     
-    db_proxy = Proxy(
+    db_proxy = await write_queue.run(lambda session: add_and_flush(session, Proxy(
         address=proxy.address,
         country=proxy.country,
         is_active=True
-    )
-    db.add(db_proxy)
-    db.commit()
-    db.refresh(db_proxy)
+    )))
     
     # إذا كان نظام أتمتة تيك توك متاحًا، قم بإضافة البروكسي إليه أيضًا
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        proxy_manager = ProxyManager()
-        proxy_manager.add_proxy(proxy.address, proxy.country)
+    if integrations.has("proxies"):
+        await integrations.call("proxies", "add_proxy", proxy.address, proxy.country)
     
     return db_proxy
 
-@app.get("/proxies/", response_model=List[ProxyResponse])
-def read_proxies(
-    skip: int = 0, 
-    limit: int = 100, 
+@router.get("/proxies/", response_model=List[ProxyResponse])
+async def read_proxies(
+    response: Response,
+    skip: int = Query(0, ge=0), 
+    limit: int = Query(100, ge=1, le=1000), 
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    proxies = db.query(Proxy).offset(skip).limit(limit).all()
-    return proxies
+    return await paginate(db, select(Proxy), [Proxy.id], response, skip, limit, cursor)
 
-@app.delete("/proxies/{proxy_id}")
-def delete_proxy(
+@router.delete("/proxies/{proxy_id}")
+async def delete_proxy(
     proxy_id: int, 
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من صلاحيات المستخدم
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="ليس لديك صلاحية لحذف بروكسي")
     
-    proxy = db.query(Proxy).filter(Proxy.id == proxy_id).first()
+    proxy = await db.get(Proxy, proxy_id)
     if proxy is None:
         raise HTTPException(status_code=404, detail="البروكسي غير موجود")
     
     # إذا كان نظام أتمتة تيك توك متاحًا، قم بإزالة البروكسي منه أيضًا
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        proxy_manager = ProxyManager()
-        proxy_manager.remove_proxy(proxy.address)
+    if integrations.has("proxies"):
+        await integrations.call("proxies", "remove_proxy", proxy.address)
     
-    db.delete(proxy)
-    db.commit()
+    await write_queue.run(lambda session: session.execute(delete(Proxy).where(Proxy.id == proxy_id)))
     return {"detail": "تم حذف البروكسي بنجاح"}
 
 # مسارات التفاعل
-@app.post("/engagements/like/", response_model=EngagementResponse)
-def like_video(
+async def add_engagement(session: AsyncSession, owner_id: int, db_engagement: Engagement):
+    db_engagement.owner_id = owner_id
+    await bump_collection_versions(session, [owner_id], "engagements")
+    return await add_and_flush(session, db_engagement)
+
+async def set_engagement_status(db_engagement: Engagement, owner_id: int, new_status: str):
+    async def set_status(session):
+        await session.execute(
+            update(Engagement).where(Engagement.id == db_engagement.id).values(status=new_status)
+        )
+        await bump_collection_versions(session, [owner_id], "engagements")
+    
+    await write_queue.run(set_status)
+    db_engagement.status = new_status
+
+async def perform_engagement(db_engagement: Engagement, owner_id: int, action: str, args: tuple, label: str):
+    # إذا كان نظام أتمتة تيك توك متاحًا، قم بتنفيذ التفاعل وتحديث حالته
+    engagement_class = load_automation().get("TikTokEngagement")
+    if engagement_class is not None:
+        try:
+            engagement = engagement_class()
+            success = await run_in_threadpool(getattr(engagement, action), *args)
+            
+            # تحديث حالة التفاعل
+            await set_engagement_status(db_engagement, owner_id, "completed" if success else "failed")
+        except Exception as e:
+            await set_engagement_status(db_engagement, owner_id, "failed")
+            raise HTTPException(status_code=500, detail=f"فشل في تنفيذ {label}: {str(e)}")
+    
+    return db_engagement
+
+@router.post("/engagements/like/", response_model=EngagementResponse)
+async def like_video(
     like_data: LikeCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من وجود الحساب
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == like_data.account_id, TikTokAccount.owner_id == current_user.id).first()
+    account = await get_owned_account(db, like_data.account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
     # إنشاء سجل التفاعل
-    db_engagement = Engagement(
+    db_engagement = await write_queue.run(lambda session: add_engagement(session, current_user.id, Engagement(
         account_id=like_data.account_id,
         engagement_type="like",
         target_url=like_data.target_url,
         status="pending"
-    )
-    db.add(db_engagement)
-    db.commit()
-    db.refresh(db_engagement)
+    )))
     
     # إذا كان نظام أتمتة تيك توك متاحًا، قم بتنفيذ الإعجاب
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        try:
-            engagement = TikTokEngagement()
-            success = engagement.like_video(account.username, like_data.target_url)
-            
-            # تحديث حالة التفاعل
-            db_engagement.status = "completed" if success else "failed"
-            db.commit()
-        except Exception as e:
-            db_engagement.status = "failed"
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"فشل في تنفيذ الإعجاب: {str(e)}")
-    
-    return db_engagement
+    return await perform_engagement(
+        db_engagement, current_user.id, "like_video", (account.username, like_data.target_url), "الإعجاب"
+    )
 
-@app.post("/engagements/comment/", response_model=EngagementResponse)
-def comment_video(
+@router.post("/engagements/comment/", response_model=EngagementResponse)
+async def comment_video(
     comment_data: CommentCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من وجود الحساب
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == comment_data.account_id, TikTokAccount.owner_id == current_user.id).first()
+    account = await get_owned_account(db, comment_data.account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
     # إنشاء سجل التفاعل
-    db_engagement = Engagement(
+    db_engagement = await write_queue.run(lambda session: add_engagement(session, current_user.id, Engagement(
         account_id=comment_data.account_id,
         engagement_type="comment",
         target_url=comment_data.target_url,
         comment_text=comment_data.comment_text,
         status="pending"
-    )
-    db.add(db_engagement)
-    db.commit()
-    db.refresh(db_engagement)
+    )))
     
     # إذا كان نظام أتمتة تيك توك متاحًا، قم بتنفيذ التعليق
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        try:
-            engagement = TikTokEngagement()
-            success = engagement.comment_video(account.username, comment_data.target_url, comment_data.comment_text)
-            
-            # تحديث حالة التفاعل
-            db_engagement.status = "completed" if success else "failed"
-            db.commit()
-        except Exception as e:
-            db_engagement.status = "failed"
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"فشل في تنفيذ التعليق: {str(e)}")
-    
-    return db_engagement
+    return await perform_engagement(
+        db_engagement, current_user.id, "comment_video", (account.username, comment_data.target_url, comment_data.comment_text), "التعليق"
+    )
 
-@app.post("/engagements/share/", response_model=EngagementResponse)
-def share_video(
+@router.post("/engagements/share/", response_model=EngagementResponse)
+async def share_video(
     share_data: ShareCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من وجود الحساب
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == share_data.account_id, TikTokAccount.owner_id == current_user.id).first()
+    account = await get_owned_account(db, share_data.account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
     # إنشاء سجل التفاعل
-    db_engagement = Engagement(
+    db_engagement = await write_queue.run(lambda session: add_engagement(session, current_user.id, Engagement(
         account_id=share_data.account_id,
         engagement_type="share",
         target_url=share_data.target_url,
         share_type=share_data.share_type,
         status="pending"
-    )
-    db.add(db_engagement)
-    db.commit()
-    db.refresh(db_engagement)
+    )))
     
     # إذا كان نظام أتمتة تيك توك متاحًا، قم بتنفيذ المشاركة
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        try:
-            engagement = TikTokEngagement()
-            success = engagement.share_video(account.username, share_data.target_url, share_data.share_type)
-            
-            # تحديث حالة التفاعل
-            db_engagement.status = "completed" if success else "failed"
-            db.commit()
-        except Exception as e:
-            db_engagement.status = "failed"
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"فشل في تنفيذ المشاركة: {str(e)}")
-    
-    return db_engagement
+    return await perform_engagement(
+        db_engagement, current_user.id, "share_video", (account.username, share_data.target_url, share_data.share_type), "المشاركة"
+    )
 
-@app.post("/engagements/save/", response_model=EngagementResponse)
-def save_video(
+@router.post("/engagements/save/", response_model=EngagementResponse)
+async def save_video(
     save_data: SaveCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من وجود الحساب
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == save_data.account_id, TikTokAccount.owner_id == current_user.id).first()
+    account = await get_owned_account(db, save_data.account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
     # إنشاء سجل التفاعل
-    db_engagement = Engagement(
+    db_engagement = await write_queue.run(lambda session: add_engagement(session, current_user.id, Engagement(
         account_id=save_data.account_id,
         engagement_type="save",
         target_url=save_data.target_url,
         status="pending"
-    )
-    db.add(db_engagement)
-    db.commit()
-    db.refresh(db_engagement)
+    )))
     
     # إذا كان نظام أتمتة تيك توك متاحًا، قم بتنفيذ الحفظ
-    if TIKTOK_AUTOMATION_AVAILABLE:
-        try:
-            engagement = TikTokEngagement()
-            success = engagement.save_video(account.username, save_data.target_url)
-            
-            # تحديث حالة التفاعل
-            db_engagement.status = "completed" if success else "failed"
-            db.commit()
-        except Exception as e:
-            db_engagement.status = "failed"
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"فشل في تنفيذ الحفظ: {str(e)}")
-    
-    return db_engagement
+    return await perform_engagement(
+        db_engagement, current_user.id, "save_video", (account.username, save_data.target_url), "الحفظ"
+    )
 
-@app.post("/engagements/follow/", response_model=EngagementResponse)
-def follow_user(
+@router.post("/engagements/follow/", response_model=EngagementResponse)
+async def follow_user(
     follow_data: FollowCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # التحقق من وجود الحساب
-    account = db.query(TikTokAccount).filter(TikTokAccount.id == follow_data.account_id, TikTokAccount.owner_id == current_user.id).first()
+    account = await get_owned_account(db, follow_data.account_id, current_user.id)
     if account is None:
         raise HTTPException(status_code=404, detail="الحساب غير موجود")
     
     # إنشاء سجل التفاعل
-    db_engagement = Engagement(
+    db_engagement = await write_queue.run(lambda session: add_engagement(session, current_user.id, Engagement(
         account_id=follow_data.account_id,
         engagement_type="follow",
         target_username=follow_data.username,
         status="pending"
-    )
-    db.add(db_engagement)
-    db.commit()
-    db.refresh(db_engagement)
+    )))
     
     # إذا كان نظام أتمتة تيك توك متاحًا، قم بتنفيذ المتابعة
-    if TIKTOK_AUTOMATION_AVAILABLE:
+    return await perform_engagement(
+        db_engagement, current_user.id, "follow_user", (account.username, follow_data.username), "المتابعة"
+    )
+
+@router.get("/engagements/", response_model=List[EngagementResponse])
+async def read_engagements(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0), 
+    limit: int = Query(100, ge=1, le=1000), 
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    not_modified = await check_collection_etag(db, request, response, current_user.id, "engagements")
+    if not_modified:
+        return not_modified
+    # تفاعلات المستخدم الأحدث أولاً؛ الفهرس (owner_id, created_at, id) يعطي ترتيب المؤشر مباشرة
+    query = select(Engagement).where(Engagement.owner_id == current_user.id)
+    return await paginate(
+        db, query, [Engagement.created_at, Engagement.id], response, skip, limit, cursor, descending=True
+    )
+
+# ملخص لوحة التحكم من العدادات المحدثة مع الكتابة بدلاً من مسح الجدولات
+SCHEDULE_STATUSES = ("pending", "processing", "completed", "failed")
+UPCOMING_WINDOWS = {"upcoming_24h": timedelta(hours=24), "upcoming_7d": timedelta(days=7)}
+
+async def count_pending_between(db: AsyncSession, owner_id: int, start: datetime, end: datetime) -> int:
+    return await db.scalar(
+        select(func.count())
+        .select_from(Schedule)
+        .where(
+            Schedule.owner_id == owner_id,
+            Schedule.schedule_time >= start,
+            Schedule.schedule_time < end,
+            Schedule.status == "pending",
+        )
+    )
+
+@router.get("/stats", response_model=StatsResponse)
+async def read_stats(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    counters = dict((await db.execute(
+        select(UserCounter.name, UserCounter.value).where(UserCounter.owner_id == current_user.id)
+    )).all())
+    schedules = {
+        schedule_status: counters.get(f"schedules.{schedule_status}", 0) for schedule_status in SCHEDULE_STATUSES
+    }
+    
+    # الجدولات القادمة = مجموع ساعات النافذة، مع طرح ما قبل الآن في الساعة الأولى وما بعد النهاية في الأخيرة
+    now = datetime.now()
+    first_hour = schedule_hour(now)
+    buckets = (await db.execute(
+        select(ScheduleHourBucket.hour, ScheduleHourBucket.pending)
+        .where(
+            ScheduleHourBucket.owner_id == current_user.id,
+            ScheduleHourBucket.hour >= first_hour,
+            ScheduleHourBucket.hour <= schedule_hour(now + max(UPCOMING_WINDOWS.values())),
+        )
+    )).all()
+    before_now = await count_pending_between(db, current_user.id, first_hour, now)
+    upcoming = {}
+    for name, window in UPCOMING_WINDOWS.items():
+        end = now + window
+        end_hour = schedule_hour(end)
+        after_end = await count_pending_between(db, current_user.id, end, end_hour + timedelta(hours=1))
+        upcoming[name] = sum(pending for hour, pending in buckets if hour <= end_hour) - before_now - after_end
+    
+    return StatsResponse(
+        accounts=counters.get("accounts", 0),
+        schedules=schedules,
+        schedules_total=sum(schedules.values()),
+        **upcoming
+    )
+
+# أدوات التشخيص للمشرفين: تحليل عينات الاستدعاء ولقطات الذاكرة دون إعادة التشغيل
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _thread_stack(frame) -> list:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def _task_stack(task, loop, loop_frame) -> list:
+    coro = task.get_coro()
+    root = getattr(coro, "cr_frame", None)
+    if root is None:
+        return []
+    # المهمة تعمل الآن على خيط الحلقة: مكدسها الحي حتى إطار الكوروتين الجذري
+    if loop_frame is not None and asyncio.current_task(loop) is task:
+        stack = []
+        frame = loop_frame
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            if frame is root:
+                stack.reverse()
+                return stack
+            frame = frame.f_back
+    # المهمة معلقة: سلسلة الانتظار من الكوروتين الجذري حتى أعمق await
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    stack.append("[await]")
+    return stack
+
+def fold_stacks(stacks: Counter) -> str:
+    # صيغة folded stacks: "إطار;إطار;إطار عدد" لكل سطر، تقرؤها أدوات flamegraph وspeedscope
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+class ProfileTarget:
+    def __init__(self, route: APIRoute, method: str, requests: int):
+        self.route = route
+        self.method = method
+        self.requests = requests
+        self.remaining = requests
+        self.completed = 0
+        self.tasks = {}  # المهمة -> (الحلقة، معرف خيطها)
+        self.lock = threading.Lock()
+        self.done = asyncio.Event()
+
+    def claim(self, scope) -> bool:
+        if self.remaining <= 0 or scope["method"] != self.method:
+            return False
+        if self.route.matches(scope)[0] != Match.FULL:
+            return False
+        self.remaining -= 1
+        return True
+
+class SamplingProfiler:
+    """محلل بأخذ العينات يعمل في خيط مستقل، فلا يكلف الطلبات شيئاً إلا أثناء جلسة تحليل."""
+
+    def __init__(self):
+        self.route_targets = []  # يفحصها ProfilingMiddleware؛ فارغة في الوضع العادي
+        self.busy = False
+
+    async def _sample(self, interval: float, collect, until):
+        stacks = Counter()
+        stop = threading.Event()
+        samples = 0
+        
+        def run():
+            nonlocal samples
+            me = threading.get_ident()
+            while not stop.wait(interval):
+                collect(stacks, sys._current_frames(), me)
+                samples += 1
+        
+        thread = threading.Thread(target=run, name="profiler", daemon=True)
+        self.busy = True
+        thread.start()
         try:
-            engagement = TikTokEngagement()
-            success = engagement.follow_user(account.username, follow_data.username)
-            
-            # تحديث حالة التفاعل
-            db_engagement.status = "completed" if success else "failed"
-            db.commit()
-        except Exception as e:
-            db_engagement.status = "failed"
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"فشل في تنفيذ المتابعة: {str(e)}")
+            await until()
+        finally:
+            stop.set()
+            await run_in_threadpool(thread.join)
+            self.busy = False
+        return stacks, samples
+
+    async def profile_process(self, seconds: float, interval: float):
+        def collect(stacks, frames, me):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != me:
+                    stacks[";".join([names.get(ident, str(ident))] + _thread_stack(frame))] += 1
+        
+        return await self._sample(interval, collect, lambda: asyncio.sleep(seconds))
+
+    async def profile_route(self, target: ProfileTarget, seconds: float, interval: float):
+        def collect(stacks, frames, me):
+            with target.lock:
+                tasks = list(target.tasks.items())
+            for task, (loop, thread_id) in tasks:
+                stack = _task_stack(task, loop, frames.get(thread_id))
+                if stack:
+                    stacks[";".join([f"{target.method} {target.route.path}"] + stack)] += 1
+        
+        async def until():
+            try:
+                await asyncio.wait_for(target.done.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        
+        self.route_targets.append(target)
+        try:
+            return await self._sample(interval, collect, until)
+        finally:
+            self.route_targets.remove(target)
+
+profiler = SamplingProfiler()
+
+class ProfilingMiddleware:
+    """يسجل مهمة الطلب لدى جلسة التحليل إذا طابق المسار المستهدف."""
+
+    def __init__(self, app, profiler: SamplingProfiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        targets = self.profiler.route_targets
+        if scope["type"] != "http" or not targets:
+            await self.app(scope, receive, send)
+            return
+        target = next((target for target in targets if target.claim(scope)), None)
+        if target is None:
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        with target.lock:
+            target.tasks[task] = (asyncio.get_running_loop(), threading.get_ident())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            with target.lock:
+                target.tasks.pop(task, None)
+            target.completed += 1
+            if target.completed >= target.requests:
+                target.done.set()
+
+def require_admin(current_user: User, detail: str):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail=detail)
+
+@router.post("/admin/profile", include_in_schema=False)
+async def profile_requests(
+    profile: ProfileRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    # التحقق من صلاحيات المستخدم
+    require_admin(current_user, "ليس لديك صلاحية لتحليل أداء الخادم")
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="توجد جلسة تحليل قيد التشغيل")
     
-    return db_engagement
+    interval = profile.interval_ms / 1000
+    if profile.route is None:
+        stacks, samples = await profiler.profile_process(profile.seconds, interval)
+        profiled = 0
+    else:
+        route = next((
+            route for route in router.routes
+            if isinstance(route, APIRoute) and route.path == profile.route and profile.method in route.methods
+        ), None)
+        if route is None:
+            raise HTTPException(status_code=404, detail="المسار غير موجود")
+        target = ProfileTarget(route, profile.method, profile.requests)
+        stacks, samples = await profiler.profile_route(target, profile.seconds, interval)
+        profiled = target.completed
+    
+    return Response(
+        fold_stacks(stacks),
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Profile-Samples": str(samples), "X-Profile-Requests": str(profiled)},
+    )
 
-@app.get("/engagements/", response_model=List[EngagementResponse])
-def read_engagements(
-    skip: int = 0, 
-    limit: int = 100, 
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+# لقطات الذاكرة عبر tracemalloc؛ كل لقطة تُقارن بالسابقة
+_memory_baseline = None
+
+def _take_memory_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+@router.post("/admin/memory/start", include_in_schema=False)
+async def start_memory_tracing(
+    frames: int = 25,
+    current_user: User = Depends(get_current_active_user)
+):
+    require_admin(current_user, "ليس لديك صلاحية لتتبع الذاكرة")
+    global _memory_baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, min(frames, 100)))
+        _memory_baseline = None
+    current, peak = tracemalloc.get_traced_memory()
+    return {"tracing": True, "frames": tracemalloc.get_traceback_limit(), "current": current, "peak": peak}
+
+@router.get("/admin/memory/snapshot", include_in_schema=False)
+async def read_memory_snapshot(
+    group_by: str = "lineno",
+    limit: int = 50,
+    output: str = "json",
+    current_user: User = Depends(get_current_active_user)
 ):
-    # الحصول على قائمة حسابات المستخدم
-    account_ids = [account.id for account in db.query(TikTokAccount).filter(TikTokAccount.owner_id == current_user.id).all()]
+    require_admin(current_user, "ليس لديك صلاحية لتتبع الذاكرة")
+    global _memory_baseline
+    if group_by not in ("lineno", "filename", "traceback") or output not in ("json", "folded"):
+        raise HTTPException(status_code=400, detail="خيارات اللقطة غير صالحة")
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="تتبع الذاكرة غير مفعّل")
+    
+    snapshot = await run_in_threadpool(_take_memory_snapshot)
+    baseline, _memory_baseline = _memory_baseline, snapshot
+    limit = max(1, min(limit, 1000))
     
-    # الحصول على التفاعلات المرتبطة بحسابات المستخدم
-    engagements = db.query(Engagement).filter(Engagement.account_id.in_(account_ids)).offset(skip).limit(limit).all()
-    return engagements
+    if output == "folded":
+        # الحجم بالبايت وزناً لكل مسار تخصيص، من الإطار الأقدم إلى الأحدث
+        statistics = await run_in_threadpool(snapshot.statistics, "traceback")
+        stacks = Counter({
+            ";".join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback): stat.size
+            for stat in statistics[:limit]
+        })
+        return Response(fold_stacks(stacks), media_type="text/plain; charset=utf-8")
+    
+    if baseline is not None:
+        statistics = await run_in_threadpool(snapshot.compare_to, baseline, group_by)
+    else:
+        statistics = await run_in_threadpool(snapshot.statistics, group_by)
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "current": current,
+        "peak": peak,
+        "compared": baseline is not None,
+        "top": [
+            {
+                "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                "size": stat.size,
+                "size_diff": getattr(stat, "size_diff", 0),
+                "count": stat.count,
+                "count_diff": getattr(stat, "count_diff", 0),
+            }
+            for stat in statistics[:limit]
+        ],
+    }
+
+@router.post("/admin/memory/stop", include_in_schema=False)
+async def stop_memory_tracing(current_user: User = Depends(get_current_active_user)):
+    require_admin(current_user, "ليس لديك صلاحية لتتبع الذاكرة")
+    global _memory_baseline
+    tracemalloc.stop()
+    _memory_baseline = None
+    return {"tracing": False}
+
+# إنشاء تطبيق FastAPI
+def create_app() -> FastAPI:
+    app = FastAPI(
+        title="نظام أتمتة تيك توك",
+        description="واجهة برمجة تطبيقات لنظام أتمتة تيك توك",
+        lifespan=lifespan
+    )
+
+    # إضافة وسيط للتحقق من المضيفين الموثوقين
+    app.add_middleware(
+        TrustedHostMiddleware, allowed_hosts=["localhost", "127.0.0.1", "tiktok-automation.example.com"]
+    )
+
+    # إعداد CORS - تحسين الأمان
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:3000", 
+            "https://tiktok-automation.example.com"
+        ],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE"],
+        allow_headers=["Authorization", "Content-Type", "Upload-Offset", "Range", "If-None-Match", "If-Range"],
+        expose_headers=["X-Next-Cursor", "Upload-Offset", "Upload-Length", "Content-Range", "Accept-Ranges", "ETag"],
+        max_age=600,  # تحديد مدة صلاحية طلبات preflight
+    )
+    
+    # إضافة رؤوس أمان
+    app.add_middleware(SecurityHeadersMiddleware)
+    app.add_exception_handler(Exception, global_exception_handler)
+    # تسجيل الطلبات المستهدفة بجلسة التحليل، ثم قياس زمن كل طلب كوسيط خارجي
+    app.add_middleware(ProfilingMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+    return app
+
+app = create_app()
+startup_timings["module_import"] = time.perf_counter() - _IMPORT_STARTED
 
 # تشغيل التطبيق
 if __name__ == "__main__":